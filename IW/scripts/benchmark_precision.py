@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+#BENCHMARK_PRECISION
+#Desc : Compares single and double precision fields of a simulation config
+#Date : 10-18-2026
+
+import sys
+import time
+import json
+import numpy as np
+
+#Source local libraries
+sys.path.append('../src')
+
+from iw_field import InternalWaveField
+
+cph = 3600
+
+#Get config file from user
+if len(sys.argv) > 1:
+    config_fname = sys.argv[1]
+else:
+    print("Usage : need configuration filename [number of time steps]")
+    sys.exit(1)
+nsteps = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+
+
+#Read Sim Params
+with open(config_fname) as param_file:
+    p = json.load(param_file)
+
+iwrange = np.linspace(0,p['range_end'],p['range_res'])
+iwdepth = np.linspace(0,p['depth_end'],p['depth_res'])
+freqs   = np.array(p['freqs'])/cph
+modes   = np.array(p['modes'])
+
+amps = []
+for i,a in enumerate(p['amps_real']):
+    zz = list(zip(a,p['amps_imag'][i],p['headings'][i]))
+    amps.append(    { 'amps' : [ complex(z[0],z[1]) for z in zz],
+                      'headings': [np.pi*z[2]/180 for z in zz]} )
+
+
+#Same field in both precisions over the last steps of the run, where
+#the phases f*t are largest
+time_stop = p['time_stop'] + p['time_step']
+times     = np.arange(time_stop - nsteps*p['time_step'],time_stop,p['time_step'])[-nsteps:]
+results   = {}
+for precision in ('double','single'):
+    iwf = InternalWaveField(iwrange,iwdepth,freqs=freqs,modes=modes,amplitudes=amps,
+                            variables=p.get('variables',['d','p','u','v','w']),
+                            precision=precision)
+    nbytes = sum(c.nbytes for c in iwf.components.values())
+    start  = time.time()
+    fields = iwf.synthesize(iwf.time_steps(times))
+    results[precision] = (nbytes,time.time() - start,fields)
+
+
+#Report
+dbytes,dtime,dfields = results['double']
+sbytes,stime,sfields = results['single']
+print("Field components : %.1f MB double, %.1f MB single" % (dbytes/2**20,sbytes/2**20))
+print("Synthesis of %d steps : %.3f s double, %.3f s single" % (len(times),dtime,stime))
+print("%4s %14s %14s %14s" % ("var","max |double|","max abs err","max rel err"))
+for var in dfields:
+    d   = dfields[var].real
+    err = np.max(abs(sfields[var].real - d))
+    print("%4s %14.4e %14.4e %14.4e" % (var,np.max(abs(d)),err,err/np.max(abs(d))))
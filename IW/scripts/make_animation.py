@@ -6,6 +6,7 @@ import functools
 import cmocean
 import glob
 import os
+from src.iw_store import read_frame, store_times
 
 def plot_depth_slice(df,ax,index,pcol):
     x = df['x'].unique()
@@ -53,7 +54,7 @@ def make_animation(path,plot_func,findex=0):
     files = files[:findex] if findex >= 0 else files 
      
     #First Frame
-    df = feather.read_dataframe(files[0])
+    df = read_dataframe(files[0])
     p = plot_func(df,ax)
     
     #Init and update function
@@ -68,6 +69,34 @@ def make_animation(path,plot_func,findex=0):
     return ani
 
 
+def make_field_animation(iwf,timeaxis,zindex=0,pcol='d',path='animation.mp4'):
+    """
+    Animates a depth slice straight from an InternalWaveField. Frames are
+    taken from a lazy view of the field so only the slice is ever computed
+    """
+    var = getattr(iwf.view(timeaxis),pcol)
+    x = iwf.range
+    xx,yy = np.meshgrid(x,x)
+    fig, ax = plt.subplots()
+    cbar_ax = fig.add_axes([0.85, 0.15, 0.05, 0.7])
+    
+    def plot_slice(ti):
+        zeta = var[ti,:,:,zindex].T
+        ax.cla()
+        p = ax.contourf(xx/1000,yy/1000,zeta,20,cmap=cmocean.cm.thermal)
+        ax.set_title('%.2f hours' % (timeaxis[ti]/3600.0))
+        ax.set_xlabel("Latitude (km)")
+        ax.set_ylabel("Longitude (km)")
+        cbar_ax.cla()
+        fig.colorbar(p, cax=cbar_ax)
+        return p
+    
+    fig.subplots_adjust(right=0.8)
+    plot_slice(0)
+    ani = FuncAnimation(fig, plot_slice, frames=range(1,len(timeaxis)), blit=False)
+    ani.save(path)
+    return ani
+
 def set_animation_attributes(fig,ax):
     ax.invert_yaxis()
     ax.set_xlabel('Range Km')
@@ -84,7 +113,7 @@ def init_animation(fig,ax,p,cbar_ax):
 
 def update_animation(fig,ax,cbar_ax,plot_func,frame):
     
-    df = feather.read_dataframe(frame)
+    df = read_dataframe(frame)
     ax.set_title('%.2f hours' % (df['t'][0]/3600.0))
     
     p = plot_func(df,ax)
@@ -93,5 +122,16 @@ def update_animation(fig,ax,cbar_ax,plot_func,frame):
     return p
 
 def get_file_list(path,fpat="run*"):
+    """
+    Frames to animate, feather files in a directory or (store,time)
+    pairs for a single parquet frame store
+    """
+    if path.endswith('.parquet'):
+        return [ (path,t) for t in store_times(path) ]
     files = glob.glob(os.path.join(path,fpat))
     return sorted(files)
+
+def read_dataframe(frame):
+    if isinstance(frame,tuple):
+        return read_frame(*frame)
+    return feather.read_dataframe(frame)
@@ -1,24 +1,92 @@
 import os
 import feather
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as pf
+import pyarrow.parquet as pq
 import src.iw_misc as misc
 from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
 
-#Maps a new columns onto a set of dataframes
-def map_scalars(path,out_col,fn):
+#Maps a new columns onto a set of dataframes. By default every file is
+#rewritten with the new column. With append only the columns fn reads are
+#loaded and the new column alone is written to a file of the same name in
+#the out_col subdirectory (row aligned with the original). The columns are
+#required in append mode, given as columns or as a columns attribute of fn
+#(e.g. map_sound_speed). Files are mapped in parallel by a pool of worker
+#processes (fn must be a module function)
+def map_scalars(path,out_col,fn,workers=1,append=False,columns=None):
+   columns = columns if columns else getattr(fn,'columns',None)
+   if append and not columns:
+        raise ValueError("Append mode needs the columns fn reads")
    files = os.listdir(path)
    #print(files)
    #fs = tqdm(files,ascii=True, total=len(files), leave=True,desc="Mapping Scalars")
-   fs = [x for x in files if x[-5:] == '.fthr']
-   for f in fs:
-        fpath = os.path.join(path,f)
-        df = feather.read_dataframe(fpath)
-        if 'd' in df.columns:
-           df[out_col] = fn(df)
-        feather.write_dataframe(df,fpath)
+   fs = [x for x in files if x[-5:] == '.fthr' or x[-8:] == '.parquet']
+   if append and not os.path.exists(os.path.join(path,out_col)):
+        os.mkdir(os.path.join(path,out_col))
+
+   args = [ (path,f,out_col,fn,append,columns) for f in fs ]
+   if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+             list(ex.map(map_file,args,chunksize=max(len(args)//(4*workers),1)))
+   else:
+        for a in args:
+             map_file(a)
+
+#Maps a single file
+def map_file(args):
+   path,f,out_col,fn,append,columns = args
+   fpath = os.path.join(path,f)
+   if f[-8:] == '.parquet':
+        map_store(fpath,out_col,fn,append,columns)
+        return
+
+   if append:
+        names = pa.ipc.open_file(pa.memory_map(fpath)).schema.names
+        if 'd' in names:
+           cols = [c for c in columns if c in names] if columns else None
+           df   = pf.read_table(fpath,columns=cols,memory_map=True).to_pandas()
+           feather.write_dataframe(pd.DataFrame({out_col : fn(df)}),
+                                   os.path.join(path,out_col,f))
+        return
+
+   df = feather.read_dataframe(fpath)
+   if 'd' in df.columns:
+      df[out_col] = fn(df)
+   feather.write_dataframe(df,fpath)
+
+#Single file frame stores, mapped one row group (time block) at a time
+def map_store(fpath,out_col,fn,append,columns):
+   if append:
+        tpath = os.path.join(os.path.dirname(fpath),out_col,os.path.basename(fpath))
+   else:
+        tpath = fpath + '.tmp'
+   pfile  = pq.ParquetFile(fpath,memory_map=True)
+   names  = pfile.schema_arrow.names
+   if 'd' not in names:
+        return
+   cols   = [c for c in columns if c in names] if append and columns else None
+   writer = None
+   for i in range(pfile.num_row_groups):
+        df = pfile.read_row_group(i,columns=cols).to_pandas()
+        col = fn(df)
+        if append:
+           df = pd.DataFrame({out_col : col})
+        else:
+           df[out_col] = col
+        table  = pa.Table.from_pandas(df,preserve_index=False)
+        writer = writer if writer else pq.ParquetWriter(tpath,table.schema)
+        writer.write_table(table,row_group_size=table.num_rows)
+   if writer:
+        writer.close()
+        if not append:
+           os.replace(tpath,fpath)
 
 #Exampling mapping function for sound speed
 def map_sound_speed(df):
     z = df['z']
     d = df['d']
     return misc.sound_prof_munk(z) + misc.sound_grad_munk(z)*d
-  
+
+map_sound_speed.columns = ['z','d']
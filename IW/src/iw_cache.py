@@ -0,0 +1,121 @@
+#IW_CACHE
+#Desc : Persistent on disk cache of internal wave vertical modes
+#Date : 10-18-2026
+
+import os
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+#Bump when the cached arrays change meaning so old entries are ignored
+CACHE_VERSION = 2
+
+class ModeCache:
+    """
+    Desc:
+    A content addressed cache of solved vertical modes. Each entry is a
+    directory named by the hash of the inputs of the mode solve holding
+    one .npy file per array, so hits can be memory mapped instead of read.
+    The least recently used entries are evicted once the cache grows past
+    max_bytes.
+
+    Attributes:
+       path : str
+         directory the cache lives in
+       max_bytes : int
+         size cap of the cache in bytes
+    """
+
+    def __init__(self,path,max_bytes=2**30):
+        self.path = path
+        self.max_bytes = max_bytes
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+
+    def key(self,depth,N2,freq,f,solver,num_modes,num_eigs):
+        """
+        Desc:
+        Hash of the stratification, depth grid, frequency and solver
+        settings of a mode solve
+        """
+        h = hashlib.sha1()
+        h.update(np.ascontiguousarray(depth,dtype=float).tobytes())
+        h.update(np.ascontiguousarray(N2,dtype=float).tobytes())
+        h.update(repr((CACHE_VERSION,float(freq),float(f),solver,
+                       int(num_modes),int(num_eigs))).encode())
+        return h.hexdigest()
+
+
+    def load(self,key):
+        """
+        Desc:
+        Returns a dictionary of memory mapped arrays stored under key, or
+        None on a miss. A hit marks the entry as recently used
+        """
+        entry = os.path.join(self.path,key)
+        if not os.path.isdir(entry):
+            return None
+        try:
+            arrays = { f[:-4] : np.load(os.path.join(entry,f),mmap_mode='r')
+                       for f in os.listdir(entry) if f.endswith('.npy') }
+        except (OSError,ValueError):
+            return None
+        os.utime(entry)
+        return arrays
+
+
+    def store(self,key,arrays,replace=False):
+        """
+        Desc:
+        Writes a dictionary of arrays under key then evicts old entries.
+        The entry is written to a temporary directory and renamed into place
+        so concurrent runs never see a partial entry. An existing entry is
+        kept unless replace is set
+        """
+        entry = os.path.join(self.path,key)
+        if os.path.isdir(entry) and not replace:
+            return
+        tmp = tempfile.mkdtemp(dir=self.path,prefix='.tmp-')
+        for name,arr in arrays.items():
+            np.save(os.path.join(tmp,name + '.npy'),np.asarray(arr))
+        old = None
+        if os.path.isdir(entry):
+            old = tempfile.mkdtemp(dir=self.path,prefix='.tmp-')
+            try:
+                os.replace(entry,os.path.join(old,key))
+            except OSError:
+                pass
+        try:
+            os.rename(tmp,entry)
+        except OSError:
+            shutil.rmtree(tmp,ignore_errors=True)
+        if old:
+            shutil.rmtree(old,ignore_errors=True)
+        self.evict()
+
+
+    def evict(self):
+        """
+        Desc:
+        Removes least recently used entries until the cache is under
+        max_bytes
+        """
+        entries = []
+        for key in os.listdir(self.path):
+            entry = os.path.join(self.path,key)
+            if key.startswith('.') or not os.path.isdir(entry):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(entry,f)) for f in os.listdir(entry))
+                entries.append((os.path.getmtime(entry),size,entry))
+            except OSError:
+                continue
+
+        total = sum(e[1] for e in entries)
+        for mtime,size,entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry,ignore_errors=True)
+            total -= size
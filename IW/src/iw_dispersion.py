@@ -0,0 +1,162 @@
+#IW_DISPERSION
+#Desc : Interpolated dispersion relation and vertical modes over a frequency band
+#Date : 10-18-2026
+
+import numpy as np
+from scipy.interpolate import CubicSpline
+from iw_modes import InternalWaveModes
+
+class DispersionTable:
+    """
+    Desc:
+    A table of vertical modes and eigenvalues solved exactly at a handful
+    of node frequencies across a band. Wavenumbers and mode shapes at any
+    frequency inside the band are interpolated with cubic splines, so dense
+    spectra need only as many eigen solves as there are nodes.
+
+    Attributes:
+       freqs : array
+         node frequencies the modes are solved at
+       error : dict
+         estimated interpolation error, the largest relative error of the
+         wavenumbers and the largest error of the d modes (relative to the
+         mode maximum) against exact solves at the midpoints between nodes
+    """
+
+    def __init__(self,depth,freqs,N2=np.array([]),f=1.1583e-5,num_modes=1,
+                 num_eigs=None,solver='sparse',cache=None,validate=True):
+        """
+        Parameters:
+          depth : array
+              vertical coordinate of modes
+          freqs : array
+              node frequencies, at least two
+          num_eigs : int
+              number of modes kept in the table (defaults to num_modes)
+          validate : bool
+              estimate the interpolation error with exact midpoint solves
+        """
+        self.depth     = depth
+        self.freqs     = np.sort(np.asarray(freqs,dtype=float))
+        self.N2        = N2
+        self.f         = f
+        self.num_modes = num_modes
+        self.num_eigs  = max(num_eigs if num_eigs else 0,num_modes)
+        self.solver    = solver
+        self.cache     = cache
+        if len(self.freqs) < 2:
+            raise ValueError("A dispersion table needs at least two node frequencies")
+
+        #Exact solves at the nodes
+        nodes   = [self.solve(fr) for fr in self.freqs]
+        self.N2 = nodes[0][2]
+        lamb,d  = self.align([n[0] for n in nodes],[n[1] for n in nodes])
+        self.lamb_spline = CubicSpline(self.freqs,lamb,axis=0)
+        self.d_spline    = CubicSpline(self.freqs,d,axis=0)
+
+        self.error = self.estimate_error() if validate else {}
+
+
+    def solve(self,freq):
+        """
+        Desc:
+        Exact mode solve at freq
+        Returns:
+           lamb,d_modes,N2 : eigenvalues and d modes sorted by mode number
+        """
+        iwm  = InternalWaveModes(self.depth,self.N2,freq=freq,f=self.f,
+                                 num_modes=self.num_modes,solver=self.solver,num_eigs=self.num_eigs,
+                                 cache=self.cache)
+        k    = np.real_if_close(iwm.hwavenumbers)
+        lamb = (freq**2 - self.f**2)/k**2
+        order = np.argsort(lamb.real)[::-1][:self.num_eigs]
+        return lamb[order],np.asarray(iwm.d_modes)[order],iwm.N2
+
+
+    def align(self,lambs,dmodes):
+        """
+        Desc:
+        Stacks the node solutions and flips the sign of each mode to match
+        the previous node, since eigen vectors have an arbitrary sign
+        """
+        d = np.array(dmodes)
+        for i in range(1,len(d)):
+            sign = np.sign(np.sum(d[i]*d[i-1],axis=1))
+            sign[sign == 0] = 1
+            d[i] = d[i]*sign[:,np.newaxis]
+        return np.array(lambs),d
+
+
+    def interpolate(self,freq):
+        """
+        Desc:
+        Eigenvalues and d modes at freq
+        Returns:
+           lamb,d_modes : arrays (mode,) and (mode,depth)
+        """
+        if freq < self.freqs[0] or freq > self.freqs[-1]:
+            raise ValueError("Frequency %g outside of the dispersion table band [%g,%g]" %
+                             (freq,self.freqs[0],self.freqs[-1]))
+        return self.lamb_spline(freq),self.d_spline(freq)
+
+
+    def hwavenumbers(self,freq):
+        """
+        Desc:
+        Interpolated horizontal wavenumbers of every mode at freq
+        """
+        lamb = self.lamb_spline(freq)
+        return np.sqrt( (freq**2 - self.f**2) / lamb )
+
+
+    def modes(self,freq):
+        """
+        Desc:
+        Interpolated InternalWaveModes at freq
+        """
+        return InterpolatedModes(self,freq)
+
+
+    def estimate_error(self):
+        """
+        Desc:
+        Compares the interpolation against exact solves at the midpoints
+        between nodes, where the spline error is largest
+        """
+        kerr = 0
+        derr = 0
+        for fr in 0.5*(self.freqs[1:] + self.freqs[:-1]):
+            lamb,d,N2 = self.solve(fr)
+            li,di     = self.interpolate(fr)
+            sign      = np.sign(np.sum(d*di,axis=1))
+            sign[sign == 0] = 1
+            d         = d*sign[:,np.newaxis]
+            ke   = np.sqrt( (fr**2 - self.f**2) / lamb )
+            ki   = np.sqrt( (fr**2 - self.f**2) / li )
+            kerr = max(kerr,np.max(abs(ki - ke)/abs(ke)))
+            derr = max(derr,np.max(abs(di - d))/np.max(abs(d)))
+        return {'hwavenumbers' : kerr, 'd_modes' : derr}
+
+
+
+class InterpolatedModes(InternalWaveModes):
+    """
+    Desc:
+    InternalWaveModes whose d modes and wavenumbers come from a
+    DispersionTable instead of an eigen solve. Pressure and velocity
+    modes are derived from the interpolated d modes as usual
+    """
+
+    def __init__(self,table,freq):
+        self.table = table
+        InternalWaveModes.__init__(self,table.depth,table.N2,freq=freq,f=table.f,
+                                   num_modes=table.num_modes,solver=table.solver,
+                                   num_eigs=table.num_eigs)
+
+
+    def generate_modes(self):
+        lamb,d = self.table.interpolate(self.freq)
+        self.hwavenumbers = np.sqrt( (self.freq**2 - self.f**2 ) / lamb )
+        self.d_modes      = d
+        self.p_modes      = self.pressure_modes()
+        self.u_modes      = self.velocity_modes()
@@ -0,0 +1,184 @@
+#IW_ENSEMBLE
+#Desc : Monte Carlo ensembles of internal wave fields sharing modes and geometry
+#Date : 10-18-2026
+
+import numpy as np
+import pandas as pd
+from iw_sim import InternalWaveSimulation
+
+class InternalWaveEnsemble(InternalWaveSimulation):
+    """
+    Desc:
+    Simulates many realizations of a field that only differ by their wave
+    amplitudes. The modes, plane waves and polarizations of the field are
+    evaluated once as unit amplitude responses of every wave heading at
+    every point, and each block of times is a single batched product of
+    (realization,time,heading wave) coefficients with the responses.
+    Frames hold every realization, told apart by the ensemble index column
+    e, and are written by the usual simulation outputs (ftype 0 or 3)
+
+    The field only provides the modes and geometry, its headings are the
+    ones of every realization. Build it with storage='factored' so that no
+    field components are computed. Responses take (heading waves) x points
+    per variable, so ensembles are meant for sensor fields or small grids
+
+    Attributes:
+       amplitudes : array
+         (realization,heading wave) complex amplitudes
+       responses : dict
+         (heading wave,point) unit amplitude response of each variable
+    """
+
+    def __init__(self,timeaxis,iwf,amplitudes,headings=None,ftype=3,**kwargs):
+        """
+        Parameters:
+          amplitudes : array or list
+              (realization,wave,heading) complex amplitudes with waves
+              ordered mode*nfreqs + frequency by mode number, e.g. from
+              iw_misc.gm_amplitude_arrays, or a list of amplitude tables with
+              the same headings as the field
+          headings : array
+              headings (radians) of an amplitude array, broadcast to its
+              shape. Every realization must have the headings of the field
+        """
+        if ftype not in (0,3):
+            raise ValueError("Ensembles are written as feather (ftype 0) or parquet (ftype 3) frames")
+        InternalWaveSimulation.__init__(self,timeaxis,iwf,ftype=ftype,**kwargs)
+        self.freq_index = iwf.wave_frequencies()
+        self.amplitudes = self.set_amplitudes(amplitudes,headings)
+        self.responses  = iwf.construct_responses(self.variables)
+        self.members    = len(self.amplitudes)
+        self.columns    = None
+
+
+    def set_amplitudes(self,amplitudes,headings=None):
+        """
+        Desc:
+        Flattens the amplitudes of every realization into (realization,
+        heading wave) rows in the order of the responses. The headings of
+        every realization are checked against the field's
+        """
+        iwf = self.iwf
+        if not isinstance(amplitudes,np.ndarray):
+            if not all(iwf.same_headings(table) for table in amplitudes):
+                raise ValueError("Ensemble members must share the headings of the field")
+            return np.array([ iwf.wave_amplitudes(table) for table in amplitudes ]).astype(iwf.dtype)
+
+        if headings is None:
+            raise ValueError("Ensemble amplitude arrays need the headings they were drawn with")
+        if amplitudes.shape[1] < (max(iwf.modes) + 1)*iwf.nfreqs:
+            raise ValueError("Ensemble amplitudes need (max(modes)+1)*nfreqs waves, "
+                             "indexed mode*nfreqs + frequency by mode number")
+        try:
+            theta = np.broadcast_to(np.asarray(headings,dtype=float),amplitudes.shape)
+        except ValueError:
+            raise ValueError("Ensemble headings must broadcast to the amplitudes %s" %
+                             (amplitudes.shape,))
+        rows = []
+        for n in range(iwf.nfreqs):
+            for m in iwf.modes:
+                amps = amplitudes[:,m*iwf.nfreqs + n]
+                h    = np.asarray(iwf.get_amplitude(m,n)['headings'],dtype=float)
+                if amps.shape[-1] != len(h) or not np.allclose(theta[:,m*iwf.nfreqs + n],h):
+                    raise ValueError("Ensemble members must share the headings of the field")
+                rows.append(amps)
+        return np.concatenate(rows,axis=1).astype(iwf.dtype)
+
+
+    def synthesize(self,steps):
+        """
+        Desc:
+        Fields of every realization at a block of time steps, each variable
+        is one (realization*time,heading wave) x (heading wave,point) product
+        Returns:
+           dict of (realization,time,point) arrays
+        """
+        steps = np.asarray(steps,dtype=self.iwf.dtype)
+        coef  = self.amplitudes[:,np.newaxis,:]*steps[np.newaxis,:,self.freq_index]
+        coef  = coef.reshape(-1,coef.shape[-1])
+        shape = (self.members,len(steps),-1)
+        return { var : np.dot(coef,self.responses[var]).reshape(shape) for var in self.variables }
+
+
+    def worker_copy(self):
+        """
+        Desc:
+        Copy sent to worker processes, the amplitudes and responses are
+        shared separately
+        """
+        sim = InternalWaveSimulation.worker_copy(self)
+        sim.amplitudes = None
+        sim.responses  = None
+        return sim
+
+
+    def shared_arrays(self):
+        """
+        Desc:
+        Arrays shared with worker processes, the field's plus the amplitudes
+        and responses of the ensemble
+        """
+        arrays = InternalWaveSimulation.shared_arrays(self)
+        arrays[('amplitudes',)] = self.amplitudes
+        for var,r in self.responses.items():
+            arrays[('responses',var)] = r
+        return arrays
+
+
+    def attach_shared(self,arrays):
+        """
+        Desc:
+        Sets the arrays of shared_arrays back on a worker copy
+        """
+        InternalWaveSimulation.attach_shared(self,arrays)
+        self.amplitudes = arrays[('amplitudes',)]
+        self.responses  = { key[1] : arr for key,arr in arrays.items() if key[0] == 'responses' }
+
+
+    def frame_size(self):
+        """
+        Desc:
+        Number of values of one variable at one time step, every
+        realization at every point
+        """
+        return self.members*int(np.prod(self.iwf.field_shape()))
+
+
+    def iter_frames(self,coords=[],timeaxis=None):
+        """
+        Desc:
+        Generator of (time,frame) pairs over the time axis, a frame holding
+        every realization at the points of the field
+        """
+        timeaxis = self.timeaxis if timeaxis is None else timeaxis
+        for block in self.make_blocks(timeaxis):
+            fields = self.synthesize(self.make_steps(block))
+            for i,t in enumerate(block):
+                yield t,self.apply_hooks(self.ensemble_frame(fields,i,t))
+
+
+    def ensemble_frame(self,fields,i,t):
+        """
+        Desc:
+        Dataframe of time index i of a block of ensemble fields, the
+        realizations one after the other
+        """
+        data = self.iwf.frame_columns(self.ensemble_columns(),t)
+        for var in fields:
+            data[var] = fields[var][:,i].real.reshape(-1)
+        return pd.DataFrame(data,copy=False)
+
+
+    def ensemble_columns(self):
+        """
+        Desc:
+        e,x,y,z columns of a frame, built once and shared by every frame
+        """
+        if self.columns is None:
+            cols = self.iwf.coordinate_columns()
+            npts = len(cols["x"])
+            columns = {"e" : np.repeat(np.arange(self.members),npts)}
+            for c in cols:
+                columns[c] = np.tile(cols[c],self.members)
+            self.columns = self.iwf.read_only(columns)
+        return self.columns
@@ -9,6 +9,13 @@ import feather
 import pandas as pd
 from scipy import interpolate
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+#Dependent variables of the field and the vertical/horizontal components
+#(see vertical_comp and horizontal_comp) each one is built from
+VARIABLES = ('d','p','u','v','w')
+VERT_COMP  = {'d' : 'd', 'p' : 'p', 'u' : 'u', 'v' : 'u', 'w' : 'w'}
+HORIZ_COMP = {'d' : 0, 'p' : 0, 'u' : 1, 'v' : 2, 'w' : 0}
 
 class InternalWaveField:
     """
@@ -22,103 +29,451 @@ class InternalWaveField:
                  amplitudes=[],
                  bfrq=np.array([]), 
                  f=1.1583e-5,
-                 offset=[0,0]):
+                 offset=[0,0],
+                 coords=[],
+                 variables=VARIABLES,
+                 solver='dense',
+                 cache=None,
+                 dispersion=None,
+                 workers=1,
+                 executor='thread',
+                 storage='dense',
+                 precision='double',
+                 keep_responses=False):
         
         print("Intializing wavefield")
         
         #Set all fields in object
-        self.set_attributes(bfrq,iwrange,iwdepth,modes,f,offset)        
+        self.set_attributes(bfrq,iwrange,iwdepth,modes,f,offset,coords)        
+        self.set_variables(variables)
+        self.solver = solver
+        self.cache  = cache
+        self.dispersion = dispersion
+        self.set_executor(workers,executor)
+        self.set_storage(storage)
+        self.set_precision(precision)
+        self.keep_responses = keep_responses
         
         #Compute phase speeds and vertical structure functions
         self.init_dispersion(freqs,amplitudes)
 
-        #Compute 3D field from phase speeds and structure functions
-        self.field = self.construct_field()
+        #Compute 3D field from phase speeds and structure functions. Factored
+        #fields only build their basis, grids may be too large to hold a field
+        if self.storage == 'factored':
+            self.basis = self.construct_basis()
+            self.field = None
+        else:
+            self.field = self.construct_field()
         
     
     def construct_field(self,step=np.array([])):
         """
         Desc:
         Constructs a 3D wave field from the vertical and horizontal
-        components by taking an outer product of the two vectors
+        components by taking an outer product of the two vectors.
+        Factored storage keeps only the per wave factors of the components,
+        with keep_responses the components are contracted from the unit
+        amplitude responses of every wave
         """
-        field = self.empty_field()
-                
         #Initialize Field Components 
-        if not self.field_components:
-            for n in range(self.nfreqs):
-                self.field_components.append(
-                     self.construct_field_component(n))
+        if self.storage == 'factored':
+            if self.basis is None:
+                self.basis = self.construct_basis()
+        
+        elif not self.field_components and self.keep_responses:
+            if self.responses is None:
+                self.responses = self.construct_responses()
+            self.set_components(self.contract_responses())
+        
+        elif not self.field_components:
+            components = self.empty_field(self.nfreqs)
+            fcs = self.parallel_map(self.construct_field_component,range(self.nfreqs))
+            for n,fc in enumerate(fcs):
+                for var in self.variables:
+                    components[var][n] = fc[var]
+            self.set_components(components)
       
         #Update Field Component Values
-        for n,fc in enumerate(self.field_components):
-           if step.size:
-               field['w'] += fc['w']*step[n] 
-               field['u'] += fc['u']*step[n] 
-               field['v'] += fc['v']*step[n] 
-               field['p'] += fc['p']*step[n] 
-               field['d'] += fc['d']*step[n] 
-           else:
-               field['w'] += fc['w']
-               field['u'] += fc['u']
-               field['v'] += fc['v']
-               field['p'] += fc['p']
-               field['d'] += fc['d']
-        
-        return field   
+        step   = step if step.size else np.ones(self.nfreqs)
+        fields = self.synthesize(step[np.newaxis,:])
+        return { var : fields[var][0] for var in fields }
+    
+    
+    def set_components(self,components):
+        """
+        Desc:
+        Sets the field components from (frequency,...) arrays of each
+        variable, e.g. ones held in shared memory
+        """
+        self.components = components
+        self.field_components = [ {var : components[var][n] for var in self.variables}
+                                   for n in range(self.nfreqs) ]
     
     
+    def synthesize(self,steps,variables=None):
+        """
+        Desc:
+        Sums the field components weighted by a (time,frequency) block of 
+        time steps. Each variable is a single (time,freq) x (freq,point) 
+        matrix product, giving a block of fields with a leading time axis.
+        Only the given variables (default all stored ones) are computed
+        """
+        if self.storage == 'factored':
+            return self.evaluate(steps,variables)
+        
+        variables = variables if variables else self.variables
+        steps  = np.asarray(steps,dtype=self.dtype)
+        shape  = (len(steps),) + self.field_shape()
+        fields = {}
+        for var in variables:
+            comps = self.components[var].reshape(self.nfreqs,-1)
+            fields[var] = np.dot(steps,comps).reshape(shape)
+        
+        return fields
+    
+    
+    def evaluate(self,steps,variables=None,index=()):
+        """
+        Desc:
+        Evaluates a block of fields (leading time axis) on a sub volume only.
+        index holds one int, slice or index array per (z,y,x) axis (or the
+        point axis of a sensor field), e.g. (slice(None),slice(None),5) for
+        a lon section. Factored fields are contracted from the wave factors
+        so only the requested points are ever computed
+        """
+        variables = variables if variables else self.variables
+        steps     = np.asarray(steps,dtype=self.dtype)
+        axes,keep = self.axis_indices(index)
+        shape     = (len(steps),) + tuple(len(ax) for ax in axes)
+        fields    = {}
+        for var in variables:
+            if self.storage == 'factored':
+                field = self.contract_basis(var,steps,axes)
+            else:
+                comps = self.components[var][np.ix_(np.arange(self.nfreqs),*axes)]
+                field = np.tensordot(steps,comps,axes=(1,0))
+            fields[var] = field.reshape(shape)[(slice(None),) + 
+                                               tuple(slice(None) if k else 0 for k in keep)]
+        
+        return fields
+
+
+    def time_steps(self,times):
+        """
+        Desc:
+        Time modulations e^(-2pi i * f *t) of the frequencies at each time
+        as a (time,frequency) array. The phases are always taken in double
+        precision since f*t grows large over long runs
+        """
+        steps = np.exp(-2*np.pi*1j*np.outer(times,self.freqs))
+        return steps.astype(self.dtype,copy=False)
+
+
+    def view(self,timeaxis):
+        """
+        Desc:
+        Lazy view of the field over a time axis. Each variable is indexed
+        like a (t,x,y,z) array (or (t,point) for a sensor field), e.g.
+        iwf.view(timeaxis).d[t,:,:,z_idx], and only the requested sub volume
+        at the requested times is computed
+        """
+        return FieldView(self,timeaxis)
+
+
+    def axis_indices(self,index):
+        """
+        Desc:
+        Converts a per axis index into 1D index arrays for every field axis
+        and whether each axis is kept (False for integer indices)
+        """
+        shape = self.field_shape()
+        index = tuple(index) + (slice(None),)*(len(shape) - len(index))
+        axes  = [ np.arange(n)[ix] for n,ix in zip(shape,index) ]
+        keep  = [ np.ndim(ax) > 0 for ax in axes ]
+        return [ np.atleast_1d(ax) for ax in axes ],keep
+
+
+    def construct_basis(self):
+        """
+        Desc:
+        Builds the factored form of the field components. Every wave, a 
+        (frequency,mode,heading) triple, contributes 
+        weight * vertical(z) * ey(y) * ex(x), so only per wave vertical
+        profiles, 1D horizontal exponentials and weights are stored. They
+        are computed in double precision and stored in the field's precision
+        """
+        freq    = []
+        weights = []
+        ex      = []
+        ey      = []
+        vert    = { var : [] for var in self.variables }
+        for n in range(self.nfreqs):
+            vc = self.vertical_comp(n)
+            for i,m in enumerate(self.modes):
+                fx,fy = self.plane_wave_factors(m,n)
+                freq.append(np.full(fx.shape[0],n))
+                weights.append(self.heading_weights(m,n))
+                ex.append(fx)
+                ey.append(fy)
+                for var in self.variables:
+                    vert[var].append(np.repeat(vc[VERT_COMP[var]][i:i+1],fx.shape[0],axis=0))
+        
+        dt = self.dtype
+        return {'freq'    : np.concatenate(freq),
+                'weights' : np.concatenate(weights,axis=1).astype(dt),
+                'ex'      : np.concatenate(ex).astype(dt),
+                'ey'      : np.concatenate(ey).astype(dt),
+                'vert'    : { var : np.concatenate(vert[var]).astype(dt) for var in self.variables }}
+
+
+    def contract_basis(self,var,steps,axes):
+        """
+        Desc:
+        Sums the wave factors of variable var weighted by the time steps
+        over the waves, on the points selected by the per axis index arrays
+        """
+        b    = self.basis
+        coef = steps[:,b['freq']]*b['weights'][HORIZ_COMP[var]]
+        if self.coords:
+            pts = axes[0]
+            return np.dot(coef,b['vert'][var][:,self.zidx[pts]]*b['ex'][:,pts]*b['ey'][:,pts])
+        
+        zi,yi,xi = axes
+        vert  = b['vert'][var][:,zi]
+        ey    = b['ey'][:,yi].T[np.newaxis,:,:]
+        ex    = b['ex'][:,xi]
+        field = np.empty((len(steps),len(zi),len(yi),len(xi)),dtype=self.dtype)
+        for i in range(len(steps)):
+            cv       = (coef[i][:,np.newaxis]*vert).T
+            field[i] = np.matmul(cv[:,np.newaxis,:]*ey,ex)
+        return field
+
+
+    def construct_responses(self,variables=None):
+        """
+        Desc:
+        Unit amplitude response of every heading wave, a (frequency,mode,
+        heading) triple, at every point of the field for each variable as
+        (heading wave,point) arrays, in the order of wave_frequencies.
+        Amplitudes only weight these responses, so they can be changed
+        without touching modes or plane waves (see set_amplitudes)
+        """
+        variables = variables if variables else self.variables
+        resp = { var : [] for var in variables }
+        for n in range(self.nfreqs):
+            vc = self.vertical_comp(n)
+            for i,m in enumerate(self.modes):
+                pol   = self.polarization(m,n)
+                ex,ey = self.plane_wave_factors(m,n)
+                if self.coords:
+                    horiz = ex*ey
+                else:
+                    horiz = (ey[:,:,np.newaxis]*ex[:,np.newaxis,:]).reshape(len(ex),1,-1)
+                for var in variables:
+                    vert = vc[VERT_COMP[var]][i]
+                    vert = vert[self.zidx] if self.coords else vert[np.newaxis,:,np.newaxis]
+                    r    = pol[HORIZ_COMP[var]][:,np.newaxis]*(vert*horiz).reshape(len(ex),-1)
+                    resp[var].append(r.astype(self.dtype))
+        return { var : np.concatenate(resp[var]) for var in variables }
+
+
+    def contract_responses(self):
+        """
+        Desc:
+        Field components weighted by the current amplitudes, each frequency
+        being the sum of its heading wave responses times their amplitudes
+        """
+        amps       = self.wave_amplitudes().astype(self.dtype)
+        bounds     = np.searchsorted(self.wave_frequencies(),np.arange(self.nfreqs+1))
+        components = self.empty_field(self.nfreqs)
+        for var in self.variables:
+            comps = components[var].reshape(self.nfreqs,-1)
+            for n in range(self.nfreqs):
+                w = slice(bounds[n],bounds[n+1])
+                comps[n] = np.dot(amps[w],self.responses[var][w])
+        return components
+
+
+    def wave_frequencies(self):
+        """
+        Desc:
+        Frequency index of every heading wave, in the order of the responses
+        and basis (frequency, then mode, then heading)
+        """
+        freq = []
+        for n in range(self.nfreqs):
+            for m in self.modes:
+                freq.append(np.full(len(self.get_amplitude(m,n)['headings']),n))
+        return np.concatenate(freq)
+
+
+    def wave_amplitudes(self,amplitudes=None):
+        """
+        Desc:
+        Complex amplitude of every heading wave of an amplitude table
+        (default the field's) in the order of the responses
+        """
+        table = amplitudes if amplitudes is not None else self.amplitudes
+        return np.concatenate([ np.asarray(table[m*self.nfreqs + n]['amps'],dtype=complex)
+                                for n in range(self.nfreqs) for m in self.modes ])
+
+
+    def set_amplitudes(self,amplitudes):
+        """
+        Desc:
+        Changes the wave amplitudes. With the same headings only the weights
+        of a factored basis or the contraction of the kept responses are
+        redone, otherwise the components are rebuilt
+        """
+        same = self.same_headings(amplitudes)
+        self.amplitudes = amplitudes
+        if not same:
+            self.responses = None
+        if self.storage == 'factored' and not same:
+            self.basis = self.construct_basis()
+        elif self.storage == 'factored':
+            weights = [ self.heading_weights(m,n) for n in range(self.nfreqs) for m in self.modes ]
+            self.basis['weights'] = np.concatenate(weights,axis=1).astype(self.dtype)
+        elif self.responses is not None:
+            self.set_components(self.contract_responses())
+        else:
+            self.field_components = []
+            self.components = None
+        
+        if self.field is not None or self.storage == 'dense':
+            self.field = self.construct_field()
+
+
+    def same_headings(self,amplitudes):
+        """
+        Desc:
+        Whether an amplitude table has the same headings as the field
+        """
+        for n in range(self.nfreqs):
+            for m in self.modes:
+                h0 = np.asarray(self.get_amplitude(m,n)['headings'],dtype=float)
+                h1 = np.asarray(amplitudes[m*self.nfreqs + n]['headings'],dtype=float)
+                if h0.shape != h1.shape or not np.allclose(h0,h1):
+                    return False
+        return True
+
+
     def construct_field_component(self,n):
         """
         Desc:
         Constructs a 3D wave field componenent for a specific frequency/wavenumber
         depending on the choosen dependent variable. These components are then summed
-        to give the total wavefield.
-        """
-        field = self.empty_field()
-       
-        for nm,m in enumerate(self.modes):
-            psi,psi_u,psi_v  = self.horizontal_comp(m,n)
-            d    = self.iwmodes[n].d_modes[m]
-            p    =  1j*self.iwmodes[n].p_modes[m]
-            u    =  1j*self.iwmodes[n].u_modes[m]  
-            w    = -1j*self.iwmodes[n].d_modes[m] * self.freqs[n]
-            for zn in range(len(self.depth)):
-                for xn in range(psi.shape[0]):
-                    for yn in range(psi.shape[1]):
-                        field[zn,xn,yn]['d']  += psi[xn,yn]*d[zn]
-                        field[zn,xn,yn]['u']  += psi_u[xn,yn]*u[zn]
-                        field[zn,xn,yn]['v']  += psi_v[xn,yn]*u[zn]
-                        field[zn,xn,yn]['p']  += psi[xn,yn]*p[zn]
-                        field[zn,xn,yn]['w']  += psi[xn,yn]*w[zn]  
+        to give the total wavefield. Each variable is formed for all modes at once as
+        a vertical (mode,z) by horizontal (mode,y,x) outer product summed over modes.
+        Only the variables stored on the field are computed.
+        """
+        field = {}
+        
+        vert  = self.vertical_comp(n)
+        horiz = [self.horizontal_comp(m,n) for m in self.modes]
+        for var in self.variables:
+            psi        = np.array([h[HORIZ_COMP[var]] for h in horiz])
+            field[var] = self.outer_sum(vert[VERT_COMP[var]],psi)
       
         return field
    
     
+    def vertical_comp(self,nf):
+        """
+        Desc:
+        Stacks the vertical structure functions of every mode for frequency 
+        index nf into (mode,depth) arrays for each dependent variable 
+        """
+        iwm = self.iwmodes[nf]
+        d   = iwm.d_modes[self.modes]
+        p   =  1j*iwm.p_modes[self.modes]
+        u   =  1j*iwm.u_modes[self.modes]
+        w   = -1j*d*self.freqs[nf]
+        return {'d' : d, 'p' : p, 'u' : u, 'w' : w}
+
+
+    def outer_sum(self,vert,horiz):
+        """
+        Desc:
+        Sums the outer products of vertical (mode,z) and horizontal (mode,y,x)
+        components over the modes giving a (z,y,x) cube. For a sensor field
+        the vertical components are sampled at the sensor depths and the
+        horizontal ones are already (mode,point), so only the sum is taken
+        """
+        if self.coords:
+            return np.einsum('mp,mp->p',vert[:,self.zidx],horiz)
+        return np.einsum('mz,myx->zyx',vert,horiz,optimize=True)
+   
+    
     def horizontal_comp(self,nm,nf):
         """
         Desc:
-        Constructs a plane wave in the horizontal with a specific 
-        wavenumber and heading for mode index nm and frequency index nf 
+        Constructs the sum of plane waves in the horizontal with a specific 
+        wavenumber over every heading of mode index nm and frequency index nf.
+        A plane wave separates as exp(2pi i kx x)*exp(2pi i ky y), so only 1D
+        exponentials are evaluated and all headings are summed in one batched
+        product weighted by the amplitudes (and u,v polarizations)
+        """
+        weights = self.heading_weights(nm,nf)
+        ex,ey   = self.plane_wave_factors(nm,nf)
+        if self.coords:
+            psi = np.dot(weights,ex*ey)
+        else:
+            psi = np.matmul(weights[:,np.newaxis,:]*ey.T[np.newaxis,:,:],ex)
+        
+        return(psi[0],psi[1],psi[2])
+
+
+    def plane_wave_factors(self,nm,nf):
+        """
+        Desc:
+        The 1D x and y exponentials of the plane waves of every heading of
+        mode index nm and frequency index nf as (heading,x) and (heading,y)
+        arrays (or (heading,point) for a sensor field)
+        """
+        x,y     = self.horizontal_axes()
+        kmag    = self.iwmodes[nf].get_hwavenumber(nm)
+        theta   = np.array(self.get_amplitude(nm,nf)['headings'],dtype=float)
+        ex      = np.exp(2*np.pi*1j*kmag*np.outer(np.cos(theta),x))
+        ey      = np.exp(2*np.pi*1j*kmag*np.outer(np.sin(theta),y))
+        return ex,ey
+
+
+    def heading_weights(self,nm,nf):
+        """
+        Desc:
+        Weights of each heading of mode index nm and frequency index nf in
+        the (psi,psi_u,psi_v) sums, the complex amplitude times the 
+        polarization of the variable, as a (3,heading) array
+        """
+        a = np.array(self.get_amplitude(nm,nf)['amps'],dtype=complex)
+        return a*self.polarization(nm,nf)
+
+
+    def polarization(self,nm,nf):
+        """
+        Desc:
+        Unit amplitude weights of each heading of mode index nm and frequency
+        index nf in the (psi,psi_u,psi_v) sums as a (3,heading) array
         """
-        xx,yy  = np.meshgrid(self.range - self.offset[0],self.range - self.offset[1])
-        kmag   = self.iwmodes[nf].get_hwavenumber(nm)
         sqsum  = np.sqrt(self.freqs[nf]**2 + self.f**2)
         r1     = self.freqs[nf]/sqsum
         r2     = self.f/sqsum
-        amps   = self.get_amplitude(nm,nf)
-        psi    = np.zeros ( shape=xx.shape, dtype='complex128' )
-        psi_u  = np.zeros ( shape=xx.shape, dtype='complex128' )
-        psi_v  = np.zeros ( shape=xx.shape, dtype='complex128' )
-        for ah in list(zip(amps['amps'],amps['headings'])):
-            pw     = self.plane_wave(kmag,ah[0],ah[1],xx,yy)
-            psi    += pw
-            psi_u  += pw*(r1*np.cos(ah[1]) + 1j*r2*np.sin(ah[1])) 
-            psi_v  += pw*(r2*np.sin(ah[1]) - 1j*r2*np.cos(ah[1]))
-        
-        return(psi,psi_u,psi_v)
+        theta  = np.array(self.get_amplitude(nm,nf)['headings'],dtype=float)
+        return np.array([ np.ones(len(theta)),
+                          r1*np.cos(theta) + 1j*r2*np.sin(theta),
+                          r2*np.sin(theta) - 1j*r2*np.cos(theta) ]).reshape(3,len(theta))
 
   
+    def horizontal_axes(self):
+        """
+        Desc:
+        Horizontal positions the plane waves are evaluated at relative to the
+        offset, the x and y axes of the grid or the sensor positions
+        """
+        return self.xaxis,self.yaxis
+
+
     def plane_wave(self,kmag,amp,heading,xx,yy):
         kx      = kmag*np.cos(heading)
         ky      = kmag*np.sin(heading)
@@ -134,16 +489,30 @@ class InternalWaveField:
         return self.amplitudes[m*self.nfreqs + n]
 
 
-    def empty_field(self):
+    def empty_field(self,nlead=None):
         """
         Desc:
+        Allocates a zeroed field holding one contiguous array per stored
+        variable in the field's precision. If given, nlead prepends an
+        axis of that length (frequency or time)
         """ 
-        field = np.zeros(shape=(len(self.range),len(self.range),len(self.depth))
-                        ,dtype=[('d','complex'),('w','complex') ,('p','complex'),
-                                ('u','complex'),('v','complex') ])
+        shape = self.field_shape()
+        shape = (nlead,) + shape if nlead is not None else shape
+        field = { var : np.zeros(shape=shape,dtype=self.dtype) for var in self.variables }
         return field
 
 
+    def field_shape(self):
+        """
+        Desc:
+        Shape of one variable of the field, (z,y,x) or (point,) when the
+        field is only evaluated at sensor coordinates
+        """
+        if self.coords:
+            return (len(self.coords),)
+        return (len(self.depth),len(self.range),len(self.range))
+
+
     def default_amplitudes(self,n):
         return([{'ar': 1 ,'ai' : 0 ,'theta' : np.pi/4} for n in range(n)])
 
@@ -168,13 +537,122 @@ class InternalWaveField:
         """
         Desc:
         Constructs a set of modes from the set of input frequencies 
-        via the dispersion relations. Mode objects contain wavenumbers
+        via the dispersion relations. Mode objects contain wavenumbers.
+        The sparse solver only solves up to the highest mode in use and
+        modes are read from/written to the mode cache when one is given.
+        With a dispersion table the modes are interpolated instead of solved
         """
-        iwmodes = []
         print(freqs)
-        for i in range(len(freqs)):
-            iwmodes.append(InternalWaveModes(self.depth,self.bfrq,freq=freqs[i]))
-        return iwmodes
+        num_eigs = int(max(self.modes)) + 1
+        if self.dispersion is not None:
+            if self.dispersion.num_eigs < num_eigs:
+                raise ValueError("Dispersion table holds %d modes, field needs %d" %
+                                 (self.dispersion.num_eigs,num_eigs))
+            self.check_dispersion(self.dispersion)
+            return list(self.parallel_map(self.dispersion.modes,freqs))
+        
+        return list(self.parallel_map(self.solve_modes,freqs))
+
+
+    def check_dispersion(self,table):
+        """
+        Desc:
+        Checks that a dispersion table was built on the field's depth grid,
+        inertial frequency and stratification (when the field has one)
+        """
+        depth = np.asarray(table.depth,dtype=float)
+        if depth.shape != np.shape(self.depth) or not np.allclose(depth,self.depth):
+            raise ValueError("Dispersion table depth grid (%d points) differs from the field's (%d points)" %
+                             (len(depth),len(self.depth)))
+        if not np.isclose(table.f,self.f):
+            raise ValueError("Dispersion table inertial frequency %g differs from the field's %g" %
+                             (table.f,self.f))
+        if self.bfrq.size and (np.shape(table.N2) != self.bfrq.shape or
+                               not np.allclose(table.N2,self.bfrq)):
+            raise ValueError("Dispersion table stratification differs from the field's")
+
+
+    def solve_modes(self,freq):
+        """
+        Desc:
+        Solves the vertical modes of a single frequency
+        """
+        num_eigs = int(max(self.modes)) + 1
+        return InternalWaveModes(self.depth,self.bfrq,freq=freq,
+                                 solver=self.solver,num_eigs=num_eigs,
+                                 cache=self.cache)
+
+
+    def set_executor(self,workers,executor):
+        """
+        Desc:
+        Sets up the pool the per frequency mode solves and field components
+        are computed with, 'thread' (NumPy and LAPACK release the GIL) or 
+        'process'. A single worker computes them sequentially
+        """
+        if executor not in ('thread','process'):
+            raise ValueError("Unknown executor %s, choose 'thread' or 'process'" % executor)
+        self.workers  = workers
+        self.executor = executor
+
+
+    def set_storage(self,storage):
+        """
+        Desc:
+        How the field components are kept, 'dense' (frequency,z,y,x) arrays
+        or 'factored' per wave vertical profiles and horizontal exponentials
+        from which fields, slices and points are contracted on request. A
+        factored field is only synthesized in full when first needed
+        """
+        if storage not in ('dense','factored'):
+            raise ValueError("Unknown storage %s, choose 'dense' or 'factored'" % storage)
+        self.storage = storage
+
+
+    def set_precision(self,precision):
+        """
+        Desc:
+        Precision the field components and fields are stored and summed in,
+        'double' (complex128) or 'single' (complex64), which halves memory
+        and bandwidth. Modes, wavenumbers and phases are always computed in
+        double precision and only rounded when stored
+        """
+        if precision not in ('double','single'):
+            raise ValueError("Unknown precision %s, choose 'double' or 'single'" % precision)
+        self.precision = precision
+        self.dtype     = np.complex64 if precision == 'single' else np.complex128
+
+
+    def parallel_map(self,fn,items):
+        """
+        Desc:
+        Maps fn over items with the field's executor, yielding the results
+        in order as they complete
+        """
+        if self.workers <= 1:
+            for item in items:
+                yield fn(item)
+            return
+        
+        #Processes get the items in one chunk per worker to pickle fn less often
+        items = list(items)
+        chunk = max(int(np.ceil(len(items)/self.workers)),1)
+        pool  = ThreadPoolExecutor if self.executor == 'thread' else ProcessPoolExecutor
+        with pool(max_workers=self.workers) as ex:
+            for result in ex.map(fn,items,chunksize=chunk):
+                yield result
+
+
+    def set_variables(self,variables):
+        """
+        Desc:
+        Stores which dependent variables (a subset of d,p,u,v,w) the field
+        computes. Variables that are not requested are never computed
+        """
+        unknown = [var for var in variables if var not in VARIABLES]
+        if unknown:
+            raise ValueError("Unknown field variables %s, choose from %s" % (unknown,VARIABLES))
+        self.variables = tuple(var for var in VARIABLES if var in variables)
 
 
     def update_field(self,step):
@@ -186,7 +664,7 @@ class InternalWaveField:
         self.field = self.construct_field(step=step)
 
  
-    def set_attributes(self,bfrq,iwrange,iwdepth,modes,f,offset):
+    def set_attributes(self,bfrq,iwrange,iwdepth,modes,f,offset,coords=[]):
         """
         Desc:
         Helper function for constructor to set all the various fields
@@ -199,6 +677,29 @@ class InternalWaveField:
         self.f       = f
         self.offset  = offset
         self.field_components = [] 
+        self.components = None
+        self.basis = None
+        self.responses = None
+        self.set_coords(coords)
+
+
+    def set_coords(self,coords):
+        """
+        Desc:
+        Stores the (x,y,z) grid indices of the sensors. When given, only these
+        points are evaluated so memory and time scale with the number of
+        sensors instead of the grid size
+        """
+        self.coords  = list(coords)
+        idx          = np.array(self.coords,dtype=int).reshape(-1,3)
+        self.xpts    = self.range[idx[:,0]]
+        self.ypts    = self.range[idx[:,1]]
+        self.zpts    = self.depth[idx[:,2]]
+        self.zidx    = idx[:,2]
+        self.columns = None
+        self.selection = None
+        self.xaxis   = (self.xpts if self.coords else self.range) - self.offset[0]
+        self.yaxis   = (self.ypts if self.coords else self.range) - self.offset[1]
     
     def to_dataframe(self,coords=[],time=0):
         """
@@ -206,50 +707,157 @@ class InternalWaveField:
         Converts the 3D array internal wave field to a panda's
         dataframe for use and convience
         """
+        if self.field is None:
+            self.field = self.construct_field()
+        if self.coords:
+            return self.sensor_data(time)
     
         return self.select_data(coords,time) if coords else self.flatten_data(time) 
    
+
+    def sensor_data(self,time):
+        """
+        Desc:
+        Dataframe of a field that was only evaluated at sensor coordinates
+        """
+        data = self.frame_columns(self.coordinate_columns(),time)
+        for var in self.field:
+            data[var] = self.field[var].real
+        
+        return pd.DataFrame(data,copy=False)
+   
     
     def select_data(self,coords,time):
-         x = [self.range[c[0]] for c in coords] 
-         y = [self.range[c[1]] for c in coords] 
-         z = [self.depth[c[2]] for c in coords]  
-         d = [self.field[c[2],c[1],c[0]]['d'].real for c in coords]
-         p = [self.field[c[2],c[1],c[0]]['p'].real for c in coords]
-         u = [self.field[c[2],c[1],c[0]]['u'].real for c in coords]
-         v = [self.field[c[2],c[1],c[0]]['v'].real for c in coords]
-         w = [self.field[c[2],c[1],c[0]]['w'].real for c in coords]
-         t = np.repeat(time,len(x))
-        
-         return pd.DataFrame({"x" : x , "y" :  y , "z" : z ,
-                              "t" : t , "d" : d, "p" : p,
-                              "u" : u , "v" : v, "w" : w})
+        """
+        Desc:
+        Dataframe of the grid points coords, gathered with one fancy index
+        per variable
+        """
+        columns,index = self.selection_columns(coords)
+        data = self.frame_columns(columns,time)
+        for var in self.field:
+            data[var] = self.field[var][index].real
+        
+        return pd.DataFrame(data,copy=False)
     
 
     def flatten_data(self,time):
-        x    = np.ndarray(shape=(1,),dtype=float)
-        y    = np.ndarray(shape=(1,),dtype=float)
-        z    = np.ndarray(shape=(1,),dtype=float)
-        d = self.field['d'].real.flatten()
-        p = self.field['p'].real.flatten()
-        u = self.field['u'].real.flatten()
-        v = self.field['v'].real.flatten()
-        w = self.field['w'].real.flatten()
-       
-        L = len(self.range)
-        H = len(self.depth)
-
-        x = np.tile(self.range,L*H) 
-        t = np.repeat(time,len(x))
-           
-        for i,yi in enumerate(self.range):
-            y = yi*np.ones(len(self.range)) if i == 0 else np.concatenate((y, yi*np.ones(L)))
-        y = np.tile(y,H)
-
-        for i,zi in enumerate(self.depth):
-            z = zi*np.ones(L*L) if i == 0 else np.concatenate((z, zi*np.ones(L*L)))
-        
-        return pd.DataFrame({"x" : x , "y" :  y , "z" : z,
-                              "t" : t , "d" : d, "p" : p,
-                              "u" : u , "v" : v, "w" : w})
+        """
+        Desc:
+        Dataframe of the whole grid, x varying fastest then y then z. The
+        variables are flat views of the real part of the field, not copies
+        """
+        data = self.frame_columns(self.coordinate_columns(),time)
+        for var in self.field:
+            data[var] = self.field[var].real.reshape(-1)
+        
+        return pd.DataFrame(data,copy=False)
+
+
+    def frame_columns(self,columns,time):
+        """
+        Desc:
+        The x,y,z,t columns of a frame from cached coordinate columns
+        """
+        data = dict(columns)
+        data["t"] = np.full(len(data["x"]),time)
+        return data
+
+
+    def coordinate_columns(self):
+        """
+        Desc:
+        x,y,z columns of every point of the field (the sensors or the whole
+        grid), built once per field and shared read only by every frame
+        """
+        if self.columns is None:
+            if self.coords:
+                columns = {"x" : self.xpts, "y" : self.ypts, "z" : self.zpts}
+            else:
+                L = len(self.range)
+                H = len(self.depth)
+                columns = {"x" : np.tile(self.range,L*H),
+                           "y" : np.tile(np.repeat(self.range,L),H),
+                           "z" : np.repeat(self.depth,L*L)}
+            self.columns = self.read_only(columns)
+        return self.columns
+
+
+    def selection_columns(self,coords):
+        """
+        Desc:
+        x,y,z columns and (z,y,x) field index of the grid points coords,
+        cached for the last coords list used
+        """
+        if self.selection is None or self.selection[0] is not coords:
+            idx     = np.array(coords,dtype=int).reshape(-1,3)
+            columns = {"x" : self.range[idx[:,0]],
+                       "y" : self.range[idx[:,1]],
+                       "z" : self.depth[idx[:,2]]}
+            self.selection = (coords,self.read_only(columns),(idx[:,2],idx[:,1],idx[:,0]))
+        return self.selection[1],self.selection[2]
+
+
+    def read_only(self,columns):
+        for col in columns.values():
+            col.flags.writeable = False
+        return columns
+
+
+
+class FieldView:
+    """
+    Desc:
+    Lazy view of an InternalWaveField over a time axis with one 
+    LazyVariable attribute per stored variable (view.d, view.u, ...)
+    """
+
+    def __init__(self,iwf,timeaxis):
+        self.iwf = iwf
+        self.timeaxis = np.asarray(timeaxis)
+        for var in iwf.variables:
+            setattr(self,var,LazyVariable(iwf,var,self.timeaxis))
+
+
+
+class LazyVariable:
+    """
+    Desc:
+    A single variable of a field over a time axis that is computed on
+    indexing. Axes are (t,x,y,z) for grid fields and (t,point) for sensor
+    fields, values are the real (physical) part of the field
+    """
 
+    def __init__(self,iwf,var,timeaxis):
+        self.iwf = iwf
+        self.var = var
+        self.timeaxis = timeaxis
+        self.axes = ('t','point') if iwf.coords else ('t','x','y','z')
+
+
+    @property
+    def shape(self):
+        fshape = self.iwf.field_shape()
+        return (len(self.timeaxis),) + (fshape if self.iwf.coords else fshape[::-1])
+
+
+    def __getitem__(self,key):
+        key = key if isinstance(key,tuple) else (key,)
+        if any(k is Ellipsis for k in key):
+            i   = [k is Ellipsis for k in key].index(True)
+            key = key[:i] + (slice(None),)*(len(self.axes) - len(key) + 1) + key[i+1:]
+        key = key + (slice(None),)*(len(self.axes) - len(key))
+        if len(key) > len(self.axes):
+            raise IndexError("too many indices, axes are %s" % (self.axes,))
+        
+        #Evaluate the field on the requested times and sub volume
+        tidx  = key[0]
+        times = np.atleast_1d(self.timeaxis[tidx])
+        index = key[1:] if self.iwf.coords else key[1:][::-1]
+        field = self.iwf.evaluate(self.iwf.time_steps(times),[self.var],index)[self.var]
+        
+        #Field axes come out as (t,z,y,x), reorder them to (t,x,y,z)
+        kept   = [ name for name,k in zip(self.axes[1:],key[1:]) if np.ndim(k) > 0 or isinstance(k,slice) ]
+        fkept  = kept if self.iwf.coords else kept[::-1]
+        field  = np.transpose(field,[0] + [ 1 + fkept.index(name) for name in kept ]).real
+        return field if np.ndim(tidx) > 0 or isinstance(tidx,slice) else field[0]
@@ -0,0 +1,234 @@
+#IW_INVERSION
+#Desc : Regularized least squares inversion of sensor data for wave amplitudes
+#Date : 10-18-2026
+
+import os
+import numpy as np
+import pyarrow.feather as pf
+import pyarrow.parquet as pq
+from scipy.linalg import cho_factor, cho_solve
+from scipy.sparse.linalg import LinearOperator, lsqr
+
+class InternalWaveInversion:
+    """
+    Desc:
+    Estimates the complex amplitudes of the waves of a field from sensor
+    data. The field, evaluated at the sensors, sets the parameter space,
+    its frequencies, modes and headings (its amplitudes are ignored). An
+    observation of variable var at sensor p and time t is
+
+        Re( sum_k A_k R_k(p) e^(-2pi i f_k t) )
+
+    with R the unit amplitude responses of the field (mode shape times
+    plane wave and polarization), so the design matrix rows are
+    [Re(G), -Im(G)] with G = R(p) e^(-2pi i f t) for the unknowns
+    [Re(A), Im(A)]. Design rows are built a block at a time from the
+    responses and time steps without any transcendental per row, and the
+    normal equations are accumulated as data is added. The solution
+    minimizes |y - Hx|^2/noise + |x|^2/prior (tapered least squares)
+
+    Attributes:
+       normal : array
+         accumulated H^T H of the data added so far
+       rhs : array
+         accumulated H^T y
+       amplitudes : list
+         amplitude table of the last solution, ready for
+         InternalWaveField.set_amplitudes
+    """
+
+    def __init__(self,iwf,variables=('d',),noise=1.0,prior=1.0,block=2**16):
+        """
+        Parameters:
+          iwf : InternalWaveField
+              field with the sensor coordinates of the data
+          variables : tuple
+              observed variables the data columns are read from
+          noise,prior : float
+              variances of the observation errors and of the amplitudes
+          block : int
+              number of observations per design matrix block
+        """
+        if not iwf.coords:
+            raise ValueError("The inversion needs a field evaluated at the sensor coordinates")
+        self.iwf        = iwf
+        self.variables  = tuple(variables)
+        self.noise      = noise
+        self.prior      = prior
+        self.block      = block
+        self.responses  = { var : r.astype(complex) for var,r in
+                            iwf.construct_responses(self.variables).items() }
+        self.freq_index = iwf.wave_frequencies()
+        self.nwaves     = len(self.freq_index)
+        self.points     = { p : i for i,p in enumerate(zip(iwf.xpts,iwf.ypts,iwf.zpts)) }
+        self.normal     = np.zeros((2*self.nwaves,2*self.nwaves))
+        self.rhs        = np.zeros(2*self.nwaves)
+        self.data       = []
+        self.amplitudes = None
+
+
+    def sensor_index(self,x,y,z):
+        """
+        Desc:
+        Sensor index of every observation position
+        """
+        xyz,inv = np.unique(np.stack([x,y,z],axis=1),axis=0,return_inverse=True)
+        try:
+            idx = np.array([ self.points[tuple(p)] for p in xyz ],dtype=int)
+        except KeyError as e:
+            raise ValueError("Observation at %s is not a sensor of the field" % (e.args[0],))
+        return idx[inv.reshape(-1)]
+
+
+    def design(self,var,pidx,times):
+        """
+        Desc:
+        Design matrix rows of observations of var at sensors pidx and times
+        """
+        tu,inv = np.unique(times,return_inverse=True)
+        steps  = self.iwf.time_steps(tu).astype(complex)[:,self.freq_index]
+        G      = self.responses[var][:,pidx].T*steps[inv.reshape(-1)]
+        return np.hstack([G.real,-G.imag])
+
+
+    def add_data(self,x,y,z,t,values):
+        """
+        Desc:
+        Adds observations, positions and times as arrays and values as a
+        dictionary of arrays per variable, to the normal equations. The
+        compact (sensor,time,value) rows are kept for solving with lsqr
+        """
+        pidx = self.sensor_index(x,y,z)
+        t    = np.asarray(t,dtype=float)
+        for var in self.variables:
+            y = np.asarray(values[var],dtype=float)
+            for i in range(0,len(y),self.block):
+                rows = slice(i,i+self.block)
+                H    = self.design(var,pidx[rows],t[rows])
+                self.normal += np.dot(H.T,H)
+                self.rhs    += np.dot(H.T,y[rows])
+            self.data.append((var,pidx,t,y))
+
+
+    def read_store(self,path,filters=None):
+        """
+        Desc:
+        Adds the observations of a parquet frame store (ftype 3), streamed
+        a batch of rows at a time straight from arrow columns
+        """
+        columns = ['x','y','z','t'] + list(self.variables)
+        if filters is not None:
+            table   = pq.read_table(path,columns=columns,filters=filters,memory_map=True)
+            batches = table.to_batches(max_chunksize=self.block)
+        else:
+            batches = pq.ParquetFile(path,memory_map=True).iter_batches(self.block,columns=columns)
+        for batch in batches:
+            cols = { c : batch.column(c).to_numpy() for c in columns }
+            self.add_data(cols['x'],cols['y'],cols['z'],cols['t'],cols)
+
+
+    def read_featherfiles(self,path,fname='run'):
+        """
+        Desc:
+        Adds the observations of every feather frame (ftype 0) of a data
+        directory, reading only the needed arrow columns
+        """
+        columns = ['x','y','z','t'] + list(self.variables)
+        for f in sorted(os.listdir(path)):
+            if not (f.startswith(fname + '-') and f.endswith('.fthr')):
+                continue
+            table = pf.read_table(os.path.join(path,f),columns=columns,memory_map=True)
+            cols  = { c : table.column(c).to_numpy() for c in columns }
+            self.add_data(cols['x'],cols['y'],cols['z'],cols['t'],cols)
+
+
+    def solve(self,method='normal',iter_lim=None,atol=1e-14,btol=1e-14):
+        """
+        Desc:
+        Solves for the amplitudes, 'normal' with a Cholesky factorization of
+        the accumulated regularized normal equations, 'lsqr' iteratively on
+        the kept data with the design matrix applied block by block.
+        iter_lim (default 20 times the number of unknowns), atol and btol
+        are passed to lsqr, whose defaults stop far from the least squares
+        solution on ill conditioned wave sets. An lsqr solve that reaches
+        iter_lim raises a RuntimeError rather than returning an unconverged
+        solution
+        Returns:
+           amplitude table of the estimated wave amplitudes
+        """
+        if method == 'normal':
+            M = self.normal/self.noise + np.eye(2*self.nwaves)/self.prior
+            x = cho_solve(cho_factor(M),self.rhs/self.noise)
+        elif method == 'lsqr':
+            iter_lim = iter_lim if iter_lim else 20*2*self.nwaves
+            result   = lsqr(self.operator(),np.concatenate([d[3] for d in self.data]),
+                            damp=np.sqrt(self.noise/self.prior),
+                            atol=atol,btol=btol,iter_lim=iter_lim)
+            x,istop,itn = result[:3]
+            if istop == 7:
+                raise RuntimeError("lsqr did not converge in %d iterations, raise iter_lim "
+                                   "or use the 'normal' method" % itn)
+        else:
+            raise ValueError("Unknown method %s, use 'normal' or 'lsqr'" % method)
+
+        self.solution   = x[:self.nwaves] + 1j*x[self.nwaves:]
+        self.amplitudes = self.amplitude_table(self.solution)
+        return self.amplitudes
+
+
+    def operator(self):
+        """
+        Desc:
+        The design matrix of the kept data as a LinearOperator, computed
+        block by block on every product so it is never held in memory
+        """
+        nrows = sum(len(d[3]) for d in self.data)
+        def blocks():
+            for var,pidx,t,y in self.data:
+                for i in range(0,len(y),self.block):
+                    rows = slice(i,i+self.block)
+                    yield self.design(var,pidx[rows],t[rows])
+        def matvec(x):
+            return np.concatenate([ np.dot(H,x.ravel()) for H in blocks() ])
+        def rmatvec(y):
+            out = np.zeros(2*self.nwaves)
+            i   = 0
+            for H in blocks():
+                out += np.dot(H.T,y.ravel()[i:i+len(H)])
+                i   += len(H)
+            return out
+        return LinearOperator((nrows,2*self.nwaves),matvec=matvec,rmatvec=rmatvec)
+
+
+    def amplitude_table(self,amps):
+        """
+        Desc:
+        Amplitude table (ordered as InternalWaveField reads it) of a vector of
+        heading wave amplitudes in the order of the responses. Rows are indexed
+        by mode number, those of modes the field does not use have no waves
+        """
+        iwf   = self.iwf
+        table = [ {'amps' : np.zeros(0,dtype=complex), 'headings' : np.zeros(0)}
+                  for i in range((max(iwf.modes) + 1)*iwf.nfreqs) ]
+        i     = 0
+        for n in range(iwf.nfreqs):
+            for m in iwf.modes:
+                h = np.asarray(iwf.get_amplitude(m,n)['headings'],dtype=float)
+                table[m*iwf.nfreqs + n] = {'amps' : amps[i:i+len(h)], 'headings' : h}
+                i += len(h)
+        return table
+
+
+    def residuals(self):
+        """
+        Desc:
+        Observed minus predicted values of the kept data with the last
+        solution
+        """
+        x = np.concatenate([self.solution.real,self.solution.imag])
+        r = []
+        for var,pidx,t,y in self.data:
+            for i in range(0,len(y),self.block):
+                rows = slice(i,i+self.block)
+                r.append(y[rows] - np.dot(self.design(var,pidx[rows],t[rows]),x))
+        return np.concatenate(r)
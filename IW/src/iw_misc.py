@@ -31,6 +31,59 @@ def generate_gm_pm(freq,j):
     return(mag,phase)
 
 
+#Draws GM realizations of every wave (mode,frequency) at once from a seeded
+#Generator. freqs are in cycles/s like InternalWaveField (the spectrum is in
+#rad/s), modes are 0 based (GM mode number j = mode + 1). headings is the
+#number of headings per wave drawn uniformly on [0,2pi), an array of fixed
+#headings (radians) or a function (rng,(realization,wave)) returning a
+#(realization,wave,heading) array. Each heading gets an equal share of the
+#wave's variance. With dfreq (cycles/s) the variance is the spectrum
+#integrated over the band of each frequency.
+#Returns amps and headings arrays (realization,wave,heading) with waves
+#ordered mode*len(freqs) + frequency as InternalWaveField reads them, the
+#mode being the mode number itself. There are (max(modes)+1)*len(freqs)
+#waves, those of modes not in modes have zero amplitude, so modes=[1,2]
+#gives the rows a field with modes [1,2] indexes
+def gm_amplitude_arrays(freqs,modes,headings=1,realizations=1,seed=None,dfreq=None):
+    rng   = np.random.default_rng(seed)
+    omega = 2*np.pi*np.asarray(freqs,dtype=float)
+    modes = np.asarray(modes,dtype=int)
+    if np.any(omega <= f):
+        raise ValueError("GM spectrum is only defined above the inertial frequency")
+    if np.any(modes < 0):
+        raise ValueError("Modes are 0 based mode numbers")
+
+    j    = np.arange(modes.max() + 1) + 1
+    spec = gm_spectral_dist(omega[np.newaxis,:],j[:,np.newaxis])
+    if dfreq is not None:
+        spec = spec*2*np.pi*np.broadcast_to(np.asarray(dfreq,dtype=float),omega.shape)
+    spec[~np.isin(j - 1,modes)] = 0
+    var  = spec.reshape(-1)
+
+    shape = (realizations,len(var))
+    if callable(headings):
+        theta = np.asarray(headings(rng,shape),dtype=float)
+    elif np.ndim(headings) == 0:
+        theta = rng.uniform(0,2*np.pi,shape + (int(headings),))
+    else:
+        theta = np.broadcast_to(np.asarray(headings,dtype=float),shape + (len(headings),))
+    shape = theta.shape
+
+    z    = rng.standard_normal(shape + (2,))
+    std  = np.sqrt(var/shape[2])[np.newaxis,:,np.newaxis]
+    amps = std*(z[...,0] + 1j*z[...,1])
+    return amps,theta
+
+#Amplitude table (list of {'amps','headings'} dicts) of one realization
+def amplitude_table(amps,headings):
+    return [ {'amps' : a, 'headings' : h} for a,h in zip(amps,headings) ]
+
+#Amplitude tables of many independent GM realizations (see gm_amplitude_arrays)
+def generate_gm_realizations(freqs,modes,headings=1,realizations=1,seed=None,dfreq=None):
+    amps,theta = gm_amplitude_arrays(freqs,modes,headings,realizations,seed,dfreq)
+    return [ amplitude_table(a,h) for a,h in zip(amps,theta) ]
+
+
 #Munk sound depth profile
 def sound_prof_munk( z ):
     cbar = 1450
@@ -5,8 +5,10 @@
 
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.integrate import solve_bvp, quad,trapz
+from scipy.integrate import solve_bvp, quad,trapezoid,cumulative_trapezoid
 from scipy.linalg import eig ,inv
+from scipy.sparse import diags
+from scipy.sparse.linalg import eigsh
 
 class InternalWaveModes:
     """
@@ -20,31 +22,96 @@ class InternalWaveModes:
        strat : func
          A function of stratification whose arguement is the 
          depth coordinate strat(depth)
+       solver : str
+         Eigen solver backend, 'dense' solves for all modes, 'sparse'
+         only for the lowest num_eigs modes. Both sort them by mode number
     """
 
     def __init__(self,depth,N2=np.array([]),freq=0,f=1.1583e-5,
-                 num_modes=1):
+                 num_modes=1,solver='dense',num_eigs=None,cache=None):
         """
         Parameters:
           depth : array
               vertical coordinate of modes
           N : func, or array
               stratification of medium
+          solver : str
+              'dense' or 'sparse' eigen solver backend
+          num_eigs : int
+              number of modes the sparse backend solves for and the
+              cache keeps (defaults to num_modes)
+          cache : ModeCache
+              optional on disk cache the modes are loaded from or saved to
         """
         #Set Attributes
-        self.set_attributes(depth,N2,freq,f,num_modes)
+        self.set_attributes(depth,N2,freq,f,num_modes,solver,num_eigs)
 
-        #Generate Vertial Modes & Wavenumbers 
-        lamb,vr = self.dmodes_evp()
+        #Load Modes & Wavenumbers from the cache or generate them
+        if not self.load_modes(cache):
+            self.generate_modes()
+            self.store_modes(cache)
+
+
+    def generate_modes(self):
+        """
+        Desc : Solves for the vertical modes and horizontal wavenumbers
+        """
+        lamb,vr = self.solve_evp()
         r      = self.normalize(vr)
-        self.hwavenumbers =  np.sqrt( (self.freq**2 - f**2 ) / lamb )
+        self.hwavenumbers =  np.sqrt( (self.freq**2 - self.f**2 ) / lamb )
         
-        self.d_modes     = [ vr[:,m] for m in np.arange(0,len(vr)) ]
+        self.d_modes     = np.ascontiguousarray(vr.T)
         self.p_modes     = self.pressure_modes()
         self.u_modes     = self.velocity_modes()
 
 
-    def set_attributes(self,depth,N2,freq,f,num_modes):
+    def cache_key(self,cache):
+        """
+        Desc : Cache key of the solve. The dense solve does not depend on
+               num_eigs, so its solves share one entry whatever num_eigs
+        """
+        num_eigs = self.num_eigs if self.solver == 'sparse' else 0
+        return cache.key(self.depth,self.N2,self.freq,self.f,
+                         self.solver,self.num_modes,num_eigs)
+
+
+    def load_modes(self,cache):
+        """
+        Desc : Sets the modes and wavenumbers from a cache hit. The mode 
+               arrays are memory mapped (mode,depth) arrays. An entry with
+               fewer than num_eigs modes is a miss
+        Returns :
+               hit : bool
+        """
+        if cache is None:
+            return False
+        arrays = cache.load(self.cache_key(cache))
+        if arrays is None or len(arrays['hwavenumbers']) < self.num_eigs:
+            return False
+        self.hwavenumbers = arrays['hwavenumbers']
+        self.d_modes      = arrays['d_modes']
+        self.p_modes      = arrays['p_modes']
+        self.u_modes      = arrays['u_modes']
+        return True
+
+
+    def store_modes(self,cache):
+        """
+        Desc : Writes the first num_eigs solved modes and wavenumbers to
+               the cache, replacing an entry with fewer modes. The dense
+               solver solves for every mode, most of which are never used
+        """
+        if cache is None:
+            return
+        k = self.num_eigs
+        cache.store(self.cache_key(cache),
+                    {'hwavenumbers' : self.hwavenumbers[:k],
+                     'd_modes' : self.d_modes[:k],
+                     'p_modes' : self.p_modes[:k],
+                     'u_modes' : self.u_modes[:k]},replace=True)
+
+
+    def set_attributes(self,depth,N2,freq,f,num_modes,solver='dense',num_eigs=None):
         """
         Desc : Set various attributes for the class
         """
@@ -53,6 +120,29 @@ class InternalWaveModes:
         self.freq = freq if freq > 0 else 2*np.pi/(3600*24)
         self.f = f   
         self.num_modes = num_modes 
+        self.solver = solver
+        self.num_eigs = max(num_eigs if num_eigs else 0,num_modes)
+        if solver not in ('dense','sparse'):
+            raise ValueError("Unknown solver %s, choose 'dense' or 'sparse'" % solver)
+
+
+    def solve_evp(self):
+        """
+        Desc : Solves the eigen value problem with the selected backend
+        """
+        if self.solver == 'sparse':
+            return self.dmodes_sparse()
+        return self.dmodes_sorted()
+
+
+    def dmodes_sorted(self):
+        """
+        Desc : Dense EVP solution with the modes sorted by mode number 
+               (largest eigenvalue first)
+        """
+        lamb,vr = self.dmodes_evp()
+        order   = np.argsort(lamb.real)[::-1]
+        return lamb[order],vr[:,order]
 
  
     def dmodes_evp(self):
@@ -77,19 +167,55 @@ class InternalWaveModes:
         lamb,vr = eig((F2-N2),D2)
         
         return lamb,vr
+
+
+    def dmodes_sparse(self):
+        """
+        Desc : Solves the same eigen value problem as dmodes_evp for only
+               the lowest num_eigs modes. Written as the symmetric problem
+               (N2-F2) v = lamb (-D2) v with a sparse tridiagonal, positive
+               definite -D2, so a Lanczos solver finds the largest
+               eigenvalues (lowest modes) in O(H) memory
+        Returns:
+               lamb,vr : array
+                 eigenvalues and unit norm eigenvectors sorted by mode number
+        """
+        #Physical Properties
+        H  = len(self.depth)
+        delta = (self.depth[H-1] - self.depth[0])/H
+        fsq = (self.freq)**2
+        
+        #Fall back to the dense solver when most modes are requested
+        k = self.num_eigs
+        if k >= H-1:
+            return self.dmodes_sorted()
+        
+        #Sparse symmetric generalized eigen value problem
+        D2 = self.tri_fdm_sparse(H,delta)
+        B  = diags(self.N2 - fsq)
+        lamb,vr = eigsh(B,k=k,M=-D2,which='LA')
+        
+        #Sort by mode number and give unit norm like the dense solver
+        order = np.argsort(lamb)[::-1]
+        lamb  = lamb[order]
+        vr    = vr[:,order]/np.linalg.norm(vr[:,order],axis=0)
+        
+        return lamb,vr
     
         
     def pressure_modes(self):
         """
         Desc : 
-        Generates pressure modes
+        Generates pressure modes for every mode at once. The pressure at
+        depth index i is the trapezoid integral of chi over the depths
+        above it (indices 0 to i-1), taken as one cumulative integral
+        Returns :
+                p_modes : array (mode,depth)
         """
-        p_modes = []
-        for m in self.d_modes:
-            omega = self.freq
-            chi = -1025 * ((self.N2 - omega**2)) * m  
-            p_mode  = [trapz(chi[0:i],self.depth[0:i]) for i in range(0,len(chi)) ]
-            p_modes.append(np.array(p_mode))
+        omega = self.freq
+        chi = -1025 * ((self.N2 - omega**2)) * self.d_modes  
+        p_modes = np.zeros(shape=chi.shape,dtype=chi.dtype)
+        p_modes[:,1:] = cumulative_trapezoid(chi,self.depth,axis=1,initial=0)[:,:-1]
         
         return p_modes
    
@@ -98,14 +224,13 @@ class InternalWaveModes:
         """
         Desc : 
         Generates the horiztonal velocity modes
+        Returns :
+                u_modes : array (mode,depth)
         """
-        uv_modes = []
         sqdiff = (self.freq**2 - self.f**2)
         sqsum  = (self.freq**2 + self.f**2)
-        for i,pm in enumerate(self.p_modes):
-            kmag   = abs(self.hwavenumbers[i])
-            uv = pm*kmag*np.sqrt(sqsum)/(1025*sqdiff)
-            uv_modes.append(uv)
+        kmag   = abs(self.hwavenumbers)[:,np.newaxis]
+        uv_modes = self.p_modes*kmag*np.sqrt(sqsum)/(1025*sqdiff)
        
         return uv_modes
 
@@ -154,6 +279,17 @@ class InternalWaveModes:
 
         return ret
 
+
+    def tri_fdm_sparse(self, N, delta):
+        """
+        Desc : Sparse version of tri_fdm
+        Returns :
+                matrix : scipy sparse csc matrix
+        """
+        off = np.ones(N-1)
+        ret = diags([off,-2*np.ones(N),off],[-1,0,1],format='csc')
+        return ret/delta**2
+
     
     #Add the depth spacing to the stratifcation grad and check if this works for R script
     def cannonical_bfrq(self):
@@ -221,8 +357,8 @@ class InternalWaveModes:
             return np.sin(np.pi*j*eta(self.depth))
         
         elif isinstance (self.N2, np.ndarray):
-            No  = trapz(self.N2,self.depth)
-            eta = np.vectorize( lambda zn : (1/No)*trapz(self.N2[zn:],self.depth[zn:]) )
+            No  = trapezoid(self.N2,self.depth)
+            eta = np.vectorize( lambda zn : (1/No)*trapezoid(self.N2[zn:],self.depth[zn:]) )
             zn = np.arange(0,len(self.depth))
             self.modes = [ np.sin(np.pi*j*eta(zn)) for j in np.arange(0,len(self.depth)) ]
             return np.sin(np.pi*j*eta(zn))
@@ -7,6 +7,7 @@ import feather
 import os
 import pandas as pd
 from iw_field import InternalWaveField 
+from iw_store import FrameStore, TileStore
 import numpy as np
 import sys
 from tqdm import tqdm
@@ -14,6 +15,17 @@ import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 import cmocean
 import functools
+import threading
+import queue
+import time
+import copy
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ThreadPoolExecutor
+
+#Longest block of time steps synthesized at once when the block length
+#is set from the byte budget
+MAX_BLOCK = 32
 
 class InternalWaveSimulation:
     """
@@ -23,13 +35,24 @@ class InternalWaveSimulation:
 
     """
 
-    def __init__(self,timeaxis,iwf,ftype=0,dpath="",fname="",chunklim=100):
+    def __init__(self,timeaxis,iwf,ftype=0,dpath="",fname="",chunklim=100,
+                 blocksize=None,variables=None,writers=1,queue_size=8,
+                 stepping='exact',anchor=256,tile=(64,128,128),hooks=None,
+                 block_bytes=2**26):
         self.frames = []
-        self.fields = []
         self.timeaxis = timeaxis
         self.iwf = iwf
         self.ftype = ftype
         self.chunklim = chunklim
+        self.blocksize = blocksize
+        self.block_bytes = block_bytes
+        self.set_variables(variables)
+        self.writers = writers
+        self.queue_size = queue_size
+        self.tile = tile
+        self.hooks = dict(hooks) if hooks else {}
+        self.io_stats = {}
+        self.set_stepping(stepping,anchor)
         self.delta_t = max(self.timeaxis)/( (len(self.timeaxis)-1) * (3600) )
         self.dpath = dpath if dpath else os.getcwd()
         self.zero_padding = int(np.floor( np.log10(len(self.timeaxis)) ) + 1)
@@ -39,37 +62,284 @@ class InternalWaveSimulation:
         self.fname = fname if fname else "iwfsim"
 
 
-    def run(self,coords=[]):
-        if len(self.timeaxis) > self.chunklim and self.ftype != 2:
-            chunk_size = int( np.floor(len(self.timeaxis)/self.chunklim) )
-            timechunks = self.make_chunks(chunk_size)
-            for i,tc in self.progressbar(timechunks, "Long Simulation"):
-                self.timeaxis = tc
-                self.simulate(coords=coords)
-                self.make_files(offset=i*chunk_size)
-                self.frames = []
-                self.fields=[] 
-       
-        else:
+    def set_variables(self,variables):
+        """
+        Desc:
+        Sets the output variables, by default every variable the field
+        stores. Only variables the field stores can be simulated
+        """
+        if not variables:
+            self.variables = self.iwf.variables
+            return
+        missing = [var for var in variables if var not in self.iwf.variables]
+        if missing:
+            raise ValueError("Variables %s are not stored on the field, choose from %s" %
+                             (missing,self.iwf.variables))
+        self.variables = variables
+
+
+    def run(self,coords=[],workers=1):
+        """
+        Desc:
+        Runs the simulation. File output is streamed, each frame is handed
+        to background writer threads as soon as it is computed, so memory
+        stays constant however long the time axis is and disk writes overlap
+        the computation of the next frames. Long time axes are still split 
+        in chunklim chunks for progress reporting. With workers > 1 the
+        time axis is split over a process pool (see run_parallel), or the
+        tiles of the grid over threads for tiled output (ftype 4)
+        """
+        if self.ftype == 2:
             self.simulate(coords=coords)
             self.make_files()
+            return
+        
+        if self.ftype == 4:
+            return self.make_tilefiles(workers)
+        
+        if workers > 1:
+            if self.ftype == 0:
+                return self.run_parallel(coords,workers)
+            print("Parallel runs need one file per frame (ftype 0), running serially")
+        
+        if self.stepping == 'phasor':
+            print("Phasor time stepping, largest deviation from exact steps : %.2e" %
+                  self.stepping_error())
+        timechunks = self.make_timechunks()
+        self.open_output()
+        writer = FrameWriter(self.write_frame,self.num_writers(),self.queue_size)
+        offset = 0
+        try:
+            for i,tc in self.progressbar(timechunks,"Simulating"):
+                for n,(t,frame) in enumerate(self.iter_frames(coords=coords,timeaxis=tc)):
+                    writer.put(frame,n+offset)
+                offset += len(tc)
+        finally:
+            writer.close()
+            self.close_output()
+        
+        self.io_stats = writer.stats()
+        print("Disk writes : %.2f s (%.2f s over all writer threads), hidden by overlap with compute : %.2f s" %
+              (self.io_stats['write_time'],self.io_stats['thread_time'],self.io_stats['hidden_time']))
+
+
+    def run_parallel(self,coords,workers):
+        """
+        Desc:
+        Splits the time blocks of the run over a pool of worker processes.
+        The large arrays (see shared_arrays) are placed in shared memory
+        rather than pickled and the rest of the simulation is sent once to
+        each worker by the pool initializer. Every worker writes the frames
+        of its own time range and blocks are the same as in a serial run,
+        so file names and contents are identical whatever the number of
+        workers
+        """
+        plan    = self.make_plan()
+        ntasks  = min(len(plan),4*workers)
+        tasks   = [ list(p) for p in np.array_split(np.arange(len(plan)),ntasks) if len(p) ]
+        handles,shms = share_arrays(self.shared_arrays())
+        sim     = self.worker_copy()
+        args    = [ (coords,[plan[i] for i in task]) for task in tasks ]
+        try:
+            with multiprocessing.Pool(workers,initializer=init_worker,initargs=(sim,handles)) as pool:
+                results = pool.imap_unordered(simulate_plan,args)
+                for i,r in self.progressbar(results,"Simulating",total=len(args)):
+                    pass
+        finally:
+            for shm in shms:
+                shm.close()
+                shm.unlink()
+
+
+    def make_timechunks(self):
+        """
+        Desc:
+        Splits long time axes into chunklim chunks
+        """
+        if len(self.timeaxis) > self.chunklim:
+            chunk_size = int( np.floor(len(self.timeaxis)/self.chunklim) )
+            return self.make_chunks(chunk_size)
+        return [self.timeaxis]
+
+
+    def make_plan(self):
+        """
+        Desc:
+        The (time index offset,time block) pairs a serial run computes
+        """
+        plan   = []
+        offset = 0
+        for tc in self.make_timechunks():
+            for block in self.make_blocks(tc):
+                plan.append((offset,block))
+                offset += len(block)
+        return plan
+
+
+    def worker_copy(self):
+        """
+        Desc:
+        Copy of the simulation sent to worker processes, without the shared
+        arrays (see shared_arrays) or any computed frames
+        """
+        sim = copy.copy(self)
+        sim.iwf = copy.copy(self.iwf)
+        sim.iwf.components = None
+        sim.iwf.field_components = []
+        sim.iwf.basis = None
+        sim.iwf.responses = None
+        sim.iwf.field = None
+        sim.frames = []
+        return sim
+
+
+    def shared_arrays(self):
+        """
+        Desc:
+        The large arrays of the simulation placed in shared memory for
+        parallel runs, the dense field components or the factored basis,
+        keyed by their path in the simulation
+        """
+        iwf    = self.iwf
+        arrays = {}
+        for var,c in (iwf.components or {}).items():
+            arrays[('components',var)] = c
+        for key,val in (iwf.basis or {}).items():
+            if isinstance(val,dict):
+                for var,v in val.items():
+                    arrays[('basis',key,var)] = v
+            else:
+                arrays[('basis',key)] = val
+        return arrays
+
+
+    def attach_shared(self,arrays):
+        """
+        Desc:
+        Sets the arrays of shared_arrays back on a worker copy
+        """
+        components = {}
+        basis      = {}
+        for key,arr in arrays.items():
+            if key[0] == 'components':
+                components[key[1]] = arr
+            elif key[0] == 'basis' and len(key) == 3:
+                basis.setdefault(key[1],{})[key[2]] = arr
+            elif key[0] == 'basis':
+                basis[key[1]] = arr
+        if components:
+            self.iwf.set_components(components)
+        if basis:
+            self.iwf.basis = basis
+
+
+    def num_writers(self):
+        """
+        Desc:
+        Number of writer threads. Frames of a single file store must be 
+        appended in order so it gets at most one
+        """
+        return min(self.writers,1) if self.ftype==3 else self.writers
+
      
     def simulate(self,coords=[]):
-        for i,t in self.progressbar(self.timeaxis,"Simulating"):
-            step = self.make_step(t)
-            self.iwf.update_field(step)
-            self.frames.append(self.iwf.to_dataframe(coords=coords,time=t))
-            self.fields.append(self.iwf.field)
+        """
+        Desc:
+        Computes all frames of the time axis and keeps them in self.frames
+        """
+        frames = self.iter_frames(coords=coords)
+        for i,(t,frame) in self.progressbar(frames,"Simulating",total=len(self.timeaxis)):
+            self.frames.append(frame)
+
+
+    def iter_frames(self,coords=[],timeaxis=None):
+        """
+        Desc:
+        Generator of (time,frame) pairs over the time axis (default the
+        simulation's). Frames are made lazily, the time steps being
+        evaluated a block at a time (see block_length) as one matrix product
+        of the time modulations with the field components, so at most one
+        block of fields is held at once
+        """
+        timeaxis = self.timeaxis if timeaxis is None else timeaxis
+        for block in self.make_blocks(timeaxis):
+            for t,field in self.simulate_block(block):
+                self.iwf.field = field
+                yield t,self.apply_hooks(self.iwf.to_dataframe(coords=coords,time=t))
+
+
+    def add_hook(self,col,fn):
+        """
+        Desc:
+        Adds a post processing hook computing the derived column col of
+        every frame as fn(frame), e.g. add_hook('c',map_sound_speed). Hooks
+        run before frames are written so derived columns cost no extra pass
+        over the output. Hooks must be picklable (module level functions)
+        for parallel runs
+        """
+        self.hooks[col] = fn
+
+
+    def apply_hooks(self,frame):
+        """
+        Desc:
+        Appends the derived columns of the hooks, in the order they were added
+        """
+        for col,fn in self.hooks.items():
+            frame[col] = fn(frame)
+        return frame
+
+
+    def simulate_block(self,block):
+        """
+        Desc:
+        Returns (time,field) pairs for a block of times. Only the
+        simulation's output variables are synthesized
+        """
+        fields = self.iwf.synthesize(self.make_steps(block),self.variables)
+        return [ (t,{ var : fields[var][i] for var in fields }) for i,t in enumerate(block) ]
 
 
-    def progressbar(self,dataset,desc):
+    def make_blocks(self,timeaxis):
+        """
+        Desc:
+        Splits a time axis into blocks of at most block_length() times
+        """
+        bs = self.block_length()
+        return [ timeaxis[i:i+bs] for i in range(0,len(timeaxis),bs) ]
+
+
+    def block_length(self):
+        """
+        Desc:
+        Number of time steps synthesized at once, blocksize if given, else
+        as many as fit in block_bytes (at most MAX_BLOCK). Frames are views
+        of their block, so frames waiting to be written keep whole blocks
+        alive and the budget bounds the memory of a run
+        """
+        if self.blocksize:
+            return max(int(self.blocksize),1)
+        step = self.frame_size()*len(self.variables)*np.dtype(self.iwf.dtype).itemsize
+        return int(min(max(self.block_bytes//step,1),MAX_BLOCK))
+
+
+    def frame_size(self):
+        """
+        Desc:
+        Number of values of one variable at one time step
+        """
+        return int(np.prod(self.iwf.field_shape()))
+
+
+    def progressbar(self,dataset,desc,total=None):
         """
         Desc:
         Helper function that wraps the tqdm library to make 
         function call shorter
         """
         iterator = enumerate(dataset)
-        return tqdm(iterator,ascii=True,total=len(dataset),leave=True,desc=desc)
+        total = total if total is not None else len(dataset)
+        return tqdm(iterator,ascii=True,total=total,leave=True,desc=desc)
 
  
     def make_chunks(self,chunk_size):
@@ -97,6 +367,100 @@ class InternalWaveSimulation:
             waves.append(np.exp(-2*np.pi*1j*f*t))
         waves = np.array(waves)
         return waves
+
+
+    def make_steps(self,times):
+        """
+        Desc:
+        Time modulations e^(-2pi i * f *t) of a block of times as a
+        (time,frequency) array
+        """
+        if self.stepping == 'phasor':
+            return self.rotate_steps(times)
+        return self.iwf.time_steps(times)
+
+
+    def set_stepping(self,stepping,anchor):
+        """
+        Desc:
+        Selects how time modulations are computed. 'exact' evaluates
+        every exponential, 'phasor' advances a per frequency phasor by the
+        constant rotation e^(-2pi i * f * dt) of a uniform time axis and
+        re-anchors it to the exact value every anchor steps to bound drift
+        """
+        if stepping not in ('exact','phasor'):
+            raise ValueError("Unknown stepping %s, use 'exact' or 'phasor'" % stepping)
+        self.stepping = stepping
+        self.anchor   = max(int(anchor),1)
+        self.phasor   = None
+        if stepping == 'exact':
+            return
+
+        dts = np.diff(self.timeaxis)
+        if len(dts) == 0 or not np.allclose(dts,dts[0],rtol=1e-9,atol=0):
+            print("Phasor stepping needs a uniform time axis, using exact steps")
+            self.stepping = 'exact'
+            return
+        self.t0 = self.timeaxis[0]
+        self.dt = (self.timeaxis[-1] - self.timeaxis[0])/len(dts)
+        self.rotation = np.exp(-2*np.pi*1j*np.asarray(self.iwf.freqs)*self.dt)
+
+
+    def rotate_steps(self,times):
+        """
+        Desc:
+        Phasor stepping of a block of times on the uniform time axis. Every
+        step is read from the cumulative product of the rotation over its
+        whole anchor interval, so the phasor of a time index only depends on
+        that index and blocks give the same bits in any order or worker
+        """
+        idx     = np.rint((np.asarray(times) - self.t0)/self.dt).astype(int)
+        anchors = idx - idx % self.anchor
+        steps   = np.empty((len(idx),len(self.rotation)),dtype=complex)
+        for a in np.unique(anchors):
+            rows        = anchors == a
+            steps[rows] = self.anchor_interval(a)[idx[rows] - a]
+        return steps
+
+
+    def anchor_interval(self,a):
+        """
+        Desc:
+        Phasors of the anchor interval starting at time index a, the exact
+        step at a rotated forward by a cumulative product. The last interval
+        is kept since consecutive blocks mostly fall in the same one
+        """
+        if self.phasor is not None and self.phasor[0] == a:
+            return self.phasor[1]
+        run     = np.empty((min(self.anchor,len(self.timeaxis)-a),len(self.rotation)),dtype=complex)
+        run[0]  = self.exact_steps([self.timeaxis[a]])[0]
+        run[1:] = self.rotation
+        np.cumprod(run,axis=0,out=run)
+        self.phasor = (a,run)
+        return run
+
+
+    def exact_steps(self,times):
+        """
+        Desc:
+        Time modulations e^(-2pi i * f *t) in double precision whatever the
+        precision of the field
+        """
+        return np.exp(-2*np.pi*1j*np.outer(times,self.iwf.freqs))
+
+
+    def stepping_error(self,nsteps=None):
+        """
+        Desc:
+        Largest absolute deviation of the phasor steps from the exact
+        exponentials (both in double precision) over the first nsteps of
+        the time axis (default one anchor interval, over which drift is
+        largest)
+        """
+        if self.stepping != 'phasor':
+            return 0.0
+        times = self.timeaxis[:nsteps if nsteps else self.anchor]
+        return np.max(abs(self.rotate_steps(times) - self.exact_steps(times)))
     
     
     def make_files(self,offset=0):
@@ -110,13 +474,91 @@ class InternalWaveSimulation:
         elif self.ftype==1:
             self.make_csvfiles()
         
+        elif self.ftype==3:
+            self.make_storefile()
+
+
+    def open_output(self):
+        """
+        Desc:
+        Opens outputs that frames are appended to
+        """
+        if self.ftype==3:
+            self.store = FrameStore(self.store_path(),block=self.block_length())
+
+
+    def close_output(self):
+        if self.ftype==3:
+            self.store.close()
+
+
+    def store_path(self):
+        return os.path.join(self.dpath,"%s.parquet" % self.fname)
+
+
+    def write_frame(self,frame,index):
+        """
+        Desc:
+        Writes a single frame with time index index to the output type
+        """
+        if self.ftype==0:
+            self.write_featherfile(frame,index)
+        
+        elif self.ftype==3:
+            self.store.append(frame)
+
 
     def make_featherfiles(self,offset=0):
         for t,f in self.progressbar(self.frames,"Writing to Disk"):
-            fmt = '{:0>' + str(self.zero_padding) + '}'
-            fname = "%s-%s.fthr" % ( self.fname, fmt.format(t+offset) )
-            path = os.path.join(self.dpath,fname)
-            feather.write_dataframe(f,path) 
+            self.write_featherfile(f,t+offset)
+
+
+    def make_storefile(self):
+        self.open_output()
+        for t,f in self.progressbar(self.frames,"Writing to Disk"):
+            self.store.append(f)
+        self.close_output()
+
+
+    def make_tilefiles(self,workers=1):
+        """
+        Desc:
+        Out of core evaluation of the grid. Each block of times is evaluated
+        tile by tile straight from the field components (or the wave factors
+        of a factored field) and every tile is streamed to the (time,z,y,x)
+        arrays of a TileStore, so memory is bounded by a block of one tile per
+        worker thread whatever the grid size
+        """
+        if self.iwf.coords:
+            raise ValueError("Tiled output (ftype 4) needs a grid field, not sensor coordinates")
+        shape  = (len(self.timeaxis),) + self.iwf.field_shape()
+        store  = TileStore(self.dpath,self.fname,shape,self.variables,self.iwf.dtype,self.tile)
+        tiles  = store.tiles()
+        offset = 0
+        try:
+            with ThreadPoolExecutor(max_workers=max(workers,1)) as ex:
+                for i,block in self.progressbar(self.make_blocks(self.timeaxis),"Simulating"):
+                    tslice = slice(offset,offset+len(block))
+                    write  = functools.partial(self.write_tile,store,tslice,self.make_steps(block))
+                    list(ex.map(write,tiles))
+                    offset += len(block)
+        finally:
+            store.close()
+
+
+    def write_tile(self,store,tslice,steps,index):
+        """
+        Desc:
+        Evaluates one tile at a block of time steps and writes it to store
+        """
+        store.write(tslice,index,self.iwf.evaluate(steps,self.variables,index))
+
+
+    def write_featherfile(self,frame,index):
+        fmt = '{:0>' + str(self.zero_padding) + '}'
+        fname = "%s-%s.fthr" % ( self.fname, fmt.format(index) )
+        path = os.path.join(self.dpath,fname)
+        feather.write_dataframe(frame,path) 
 
 
     def make_metadata_file(self):
@@ -145,3 +587,180 @@ class InternalWaveSimulation:
 
     def compute_run_time(self):
         pass
+
+
+
+class FrameWriter:
+    """
+    Desc:
+    Writes frames on background threads fed by a bounded queue. When the
+    disk falls behind the queue fills up and put blocks, which throttles
+    the computation (backpressure). With zero threads frames are written
+    synchronously in put.
+
+    Attributes:
+       write : func
+         write(frame,index) called for every frame
+       write_time : float
+         wall clock time at least one frame was being written
+       thread_time : float
+         time spent writing summed over the threads
+    """
+
+    def __init__(self,write,nthreads=1,maxsize=8):
+        self.write      = write
+        self.queue      = queue.Queue(maxsize=max(int(maxsize),1))
+        self.lock       = threading.Lock()
+        self.error      = None
+        self.write_time = 0
+        self.thread_time = 0
+        self.wait_time  = 0
+        self.busy       = 0
+        self.busy_start = 0
+        self.threads    = [ threading.Thread(target=self.worker,daemon=True)
+                            for i in range(nthreads) ]
+        for thread in self.threads:
+            thread.start()
+
+
+    def put(self,frame,index):
+        """
+        Desc:
+        Queues a frame for writing, blocking while the queue is full
+        """
+        if self.error is not None:
+            raise self.error
+        
+        start = time.perf_counter()
+        if self.threads:
+            self.queue.put((frame,index))
+            self.wait_time += time.perf_counter() - start
+        else:
+            self.write(frame,index)
+            elapsed = time.perf_counter() - start
+            self.write_time  += elapsed
+            self.thread_time += elapsed
+            self.wait_time   += elapsed
+
+
+    def worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            with self.lock:
+                start = time.perf_counter()
+                if self.busy == 0:
+                    self.busy_start = start
+                self.busy += 1
+            try:
+                if self.error is None:
+                    self.write(*item)
+            except Exception as e:
+                self.error = e
+            with self.lock:
+                end = time.perf_counter()
+                self.busy -= 1
+                self.thread_time += end - start
+                if self.busy == 0:
+                    self.write_time += end - self.busy_start
+            self.queue.task_done()
+
+
+    def close(self):
+        """
+        Desc:
+        Waits for every queued frame to be written and stops the threads
+        """
+        start = time.perf_counter()
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.wait_time += time.perf_counter() - start
+        if self.error is not None:
+            raise self.error
+
+
+    def stats(self):
+        """
+        Desc:
+        Time spent writing and how much of it was hidden behind the
+        computation, i.e. not spent waiting on the writers. Write time is
+        the wall clock time any writer was busy (the union of their busy
+        intervals) so it compares with the wait, thread time is summed over
+        the threads
+        """
+        return {'write_time'  : self.write_time,
+                'thread_time' : self.thread_time,
+                'wait_time'   : self.wait_time,
+                'hidden_time' : max(self.write_time - self.wait_time,0)}
+
+
+
+#Simulation and shared memory blocks of a worker process, set once per
+#process by init_worker
+worker_state = {}
+
+def init_worker(sim,handles):
+    """
+    Desc:
+    Worker process initializer, attaches the shared arrays to the copy of
+    the simulation the pool sent. The blocks stay attached for the life of
+    the process
+    """
+    shms,arrays = attach_arrays(handles)
+    sim.attach_shared(arrays)
+    worker_state['sim']  = sim
+    worker_state['shms'] = shms
+
+
+def simulate_plan(args):
+    """
+    Desc:
+    Worker process entry point, computes and writes the frames of a list
+    of (time index offset,time block) pairs
+    """
+    coords,plan = args
+    sim    = worker_state['sim']
+    writer = FrameWriter(sim.write_frame,sim.num_writers(),sim.queue_size)
+    try:
+        for offset,block in plan:
+            for n,(t,frame) in enumerate(sim.iter_frames(coords=coords,timeaxis=block)):
+                writer.put(frame,offset+n)
+    finally:
+        writer.close()
+    return len(plan)
+
+
+def share_arrays(arrays):
+    """
+    Desc:
+    Copies a dictionary of arrays into shared memory
+    Returns:
+       handles : dict of (name,shape,dtype) to attach the arrays with
+       shms : list of SharedMemory blocks to close and unlink when done
+    """
+    handles = {}
+    shms    = []
+    for key,arr in arrays.items():
+        shm = shared_memory.SharedMemory(create=True,size=max(arr.nbytes,1))
+        np.ndarray(arr.shape,dtype=arr.dtype,buffer=shm.buf)[...] = arr
+        handles[key] = (shm.name,arr.shape,arr.dtype.str)
+        shms.append(shm)
+    return handles,shms
+
+
+def attach_arrays(handles):
+    """
+    Desc:
+    Attaches to arrays placed in shared memory by share_arrays
+    """
+    shms   = []
+    arrays = {}
+    for key,(name,shape,dtype) in handles.items():
+        shm = shared_memory.SharedMemory(name=name)
+        arrays[key] = np.ndarray(shape,dtype=np.dtype(dtype),buffer=shm.buf)
+        shms.append(shm)
+    return shms,arrays
@@ -0,0 +1,164 @@
+#IW_STORE
+#Desc : On disk stores of simulation frames, single file columnar (parquet)
+#       and tiled memory mapped arrays
+#Date : 10-18-2026
+
+import os
+import itertools
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+class FrameStore:
+    """
+    Desc:
+    Appends simulation frames to a single parquet file. Frames are
+    buffered and written as one row group per block of time steps, so
+    the min/max statistics of each row group let readers skip whole time
+    blocks (or x,y,z ranges) when filtering.
+
+    Attributes:
+       path : str
+         file the store is written to
+       block : int
+         number of frames per row group
+    """
+
+    def __init__(self,path,block=32):
+        self.path   = path
+        self.block  = max(int(block),1)
+        self.writer = None
+        self.frames = []
+
+
+    def append(self,frame):
+        """
+        Desc:
+        Adds a frame, writing a row group once a block of frames is buffered
+        """
+        self.frames.append(frame)
+        if len(self.frames) >= self.block:
+            self.flush()
+
+
+    def flush(self):
+        """
+        Desc:
+        Writes the buffered frames as one row group
+        """
+        if not self.frames:
+            return
+        table = pa.Table.from_pandas(pd.concat(self.frames,ignore_index=True),
+                                     preserve_index=False)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path,table.schema)
+        self.writer.write_table(table,row_group_size=table.num_rows)
+        self.frames = []
+
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+
+def read_store(path,filters=None,columns=None):
+    """
+    Desc:
+    Reads a frame store into a dataframe. The file is memory mapped and
+    filters, e.g. [('t','>=',3600),('z','==',500)], are pushed down to
+    skip row groups that cannot match
+    """
+    table = pq.read_table(path,columns=columns,filters=filters,memory_map=True)
+    return table.to_pandas()
+
+
+def store_times(path):
+    """
+    Desc:
+    Sorted unique times held in a frame store
+    """
+    t = pq.read_table(path,columns=['t'],memory_map=True).column('t')
+    return np.unique(t.to_numpy())
+
+
+def read_frame(path,time):
+    """
+    Desc:
+    The frame of a single time step
+    """
+    return read_store(path,filters=[('t','==',time)])
+
+
+
+class TileStore:
+    """
+    Desc:
+    One memory mapped (time,z,y,x) .npy array per variable, <fname>-<var>.npy,
+    written tile by tile. Arrays are created sparse on disk and pages are
+    flushed by the OS, so only the tile being written needs to be in memory
+    and arrays far larger than RAM can be filled. Values are the real part
+    of the field in its precision (float32 for single precision fields)
+
+    Attributes:
+       shape : tuple
+         (time,z,y,x) shape of every array
+       tile : tuple
+         (z,y,x) size of the tiles
+    """
+
+    def __init__(self,path,fname,shape,variables,dtype=np.complex128,tile=(64,128,128)):
+        self.path   = path
+        self.fname  = fname
+        self.shape  = tuple(shape)
+        self.tile   = tuple(max(int(n),1) for n in tile)
+        self.arrays = { var : np.lib.format.open_memmap(self.array_path(var),mode='w+',
+                                                        dtype=np.finfo(dtype).dtype,
+                                                        shape=self.shape)
+                        for var in variables }
+
+
+    def array_path(self,var):
+        return os.path.join(self.path,"%s-%s.npy" % (self.fname,var))
+
+
+    def tiles(self):
+        """
+        Desc:
+        (z,y,x) slices of every tile of the grid
+        """
+        ranges = [ [ slice(i,min(i+t,n)) for i in range(0,n,t) ]
+                   for n,t in zip(self.shape[1:],self.tile) ]
+        return list(itertools.product(*ranges))
+
+
+    def write(self,tslice,index,fields):
+        """
+        Desc:
+        Writes a block of fields (leading time axis) of the tile index at
+        the times tslice. Tiles do not overlap so they can be written
+        concurrently
+        """
+        for var in self.arrays:
+            self.arrays[var][(tslice,) + tuple(index)] = fields[var].real
+
+
+    def close(self):
+        for var in self.arrays:
+            self.arrays[var].flush()
+        self.arrays = {}
+
+
+
+def read_tiles(path,fname='run'):
+    """
+    Desc:
+    Read only memory maps of the (time,z,y,x) arrays of a tile store, one
+    per variable, so any slice can be read without loading the arrays
+    """
+    prefix = fname + '-'
+    return { f[len(prefix):-4] : np.load(os.path.join(path,f),mmap_mode='r')
+             for f in sorted(os.listdir(path)) if f.startswith(prefix) and f.endswith('.npy') }
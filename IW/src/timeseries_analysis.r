@@ -73,6 +73,10 @@ multidim_samples <- function(path,coords,timesamples){
 
 merge_time_frames <- function(path,timesamples){
     meta  <- read_meta(path)
+    store <- list.files(path=path,pattern="^run.*\\.parquet$")
+    if (length(store) > 0){
+        return ( read_time_store(paste(path,store[1],sep='/'),timesamples) )
+    }
     files <- list.files(path=path,pattern="^run")
     df   <- data.frame()
     for (f in files[timesamples] ){
@@ -84,6 +88,17 @@ merge_time_frames <- function(path,timesamples){
 
 }
 
+read_time_store <- function(fname,timesamples){
+    #Single parquet file holding every frame (ftype 3). Only the t column
+    #is read to pick the times, the filter on t is then pushed down to the
+    #row groups so only the frames asked for are read
+    times <- arrow::read_parquet(fname,col_select="t")$t
+    times <- sort(unique(times))[timesamples]
+    ds    <- arrow::open_dataset(fname)
+    df    <- dplyr::collect(dplyr::filter(ds,t %in% times))
+    return ( df[order(df$t),] )
+}
+
 read_data_dir <- function(path,timesamples,epsi){
     #Setup datapath and read metafile
     meta    <- read_meta(path)
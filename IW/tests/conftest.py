@@ -0,0 +1,35 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0,os.path.join(os.path.dirname(__file__),'..','src'))
+
+from iw_field import InternalWaveField
+
+FREQS      = np.array([0.0805,0.1])/3600
+AMPLITUDES = [{'amps' : [1+0.5j,0.3], 'headings' : [0.2,1.3]},
+              {'amps' : [0.7j],       'headings' : [2.0]},
+              {'amps' : [1.0,2.0],    'headings' : [0.1,0.9]},
+              {'amps' : [0.4],        'headings' : [3.0]}]
+SENSORS    = [(1,2,3),(4,5,6),(9,0,2)]
+
+
+@pytest.fixture
+def freqs():
+    return FREQS
+
+
+@pytest.fixture
+def make_field():
+    """
+    Desc:
+    Factory of the small two frequency test field, by default modes 0 and 1
+    evaluated at three sensors of a 10 range by 12 depth grid. Other
+    keywords are passed to InternalWaveField
+    """
+    def make(nrange=10,ndepth=12,modes=(0,1),amplitudes=None,coords=SENSORS,**kwargs):
+        amplitudes = amplitudes if amplitudes is not None else AMPLITUDES
+        return InternalWaveField(np.linspace(0,5e4,nrange),np.linspace(0,5e3,ndepth),freqs=FREQS,
+                                 modes=np.array(modes),amplitudes=amplitudes,coords=coords,**kwargs)
+    return make
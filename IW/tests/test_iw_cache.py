@@ -0,0 +1,50 @@
+import os
+import numpy as np
+
+from iw_cache import ModeCache
+from iw_modes import InternalWaveModes
+
+DEPTH = np.linspace(0,5e3,40)
+FREQ  = 0.0805/3600
+
+
+def entries(cache):
+    return [ e for e in os.listdir(cache.path) if not e.startswith('.') ]
+
+
+def test_dense_cache_keeps_num_eigs_modes(tmp_path):
+    cache = ModeCache(str(tmp_path))
+    ref   = InternalWaveModes(DEPTH,freq=FREQ,num_eigs=3)
+    InternalWaveModes(DEPTH,freq=FREQ,num_eigs=3,cache=cache)
+    hit   = InternalWaveModes(DEPTH,freq=FREQ,num_eigs=2,cache=cache)
+    assert len(entries(cache)) == 1
+    assert hit.d_modes.shape == (3,len(DEPTH))
+    for name in ('hwavenumbers','d_modes','p_modes','u_modes'):
+        assert np.array_equal(getattr(hit,name),getattr(ref,name)[:3]), name
+    assert np.all(np.diff(abs(ref.hwavenumbers)) > 0)
+
+
+def test_dense_cache_grows_entry(tmp_path):
+    cache = ModeCache(str(tmp_path))
+    InternalWaveModes(DEPTH,freq=FREQ,num_eigs=2,cache=cache)
+    more  = InternalWaveModes(DEPTH,freq=FREQ,num_eigs=5,cache=cache)
+    hit   = InternalWaveModes(DEPTH,freq=FREQ,num_eigs=4,cache=cache)
+    assert len(entries(cache)) == 1
+    assert len(more.hwavenumbers) == len(DEPTH)
+    assert np.array_equal(hit.d_modes,more.d_modes[:5])
+
+
+def test_evict_skips_vanished_entries(tmp_path,monkeypatch):
+    cache = ModeCache(str(tmp_path),max_bytes=0)
+    cache.store('a',{'x' : np.zeros(10)})
+    cache.store('b',{'x' : np.zeros(10)})
+    os.makedirs(os.path.join(cache.path,'c'))
+    getsize = os.path.getsize
+    def vanished(path):
+        if os.sep + 'c' + os.sep in path or path.endswith(os.sep + 'c'):
+            raise FileNotFoundError(path)
+        return getsize(path)
+    open(os.path.join(cache.path,'c','x.npy'),'w').close()
+    monkeypatch.setattr(os.path,'getsize',vanished)
+    cache.evict()
+    assert entries(cache) == ['c']
@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from iw_dispersion import DispersionTable
+
+VARIABLES = ['d','p','u','v','w']
+
+#Non square grid (7 range by 11 depth points) with an offset
+GRID = {'nrange' : 7, 'ndepth' : 11, 'coords' : [], 'offset' : (1e3,-2e3)}
+
+
+def loop_field_component(iwf,n):
+    """
+    Desc:
+    The original triple loop construction of a field component, kept as
+    the reference of the vectorized one
+    """
+    xx,yy = np.meshgrid(iwf.range - iwf.offset[0],iwf.range - iwf.offset[1])
+    field = { var : np.zeros((len(iwf.depth),) + xx.shape,dtype=complex) for var in VARIABLES }
+    sqsum = np.sqrt(iwf.freqs[n]**2 + iwf.f**2)
+    r1    = iwf.freqs[n]/sqsum
+    r2    = iwf.f/sqsum
+    for m in iwf.modes:
+        kmag  = iwf.iwmodes[n].get_hwavenumber(m)
+        amps  = iwf.get_amplitude(m,n)
+        psi   = np.zeros(xx.shape,dtype=complex)
+        psi_u = np.zeros(xx.shape,dtype=complex)
+        psi_v = np.zeros(xx.shape,dtype=complex)
+        for a,h in zip(amps['amps'],amps['headings']):
+            pw     = iwf.plane_wave(kmag,a,h,xx,yy)
+            psi   += pw
+            psi_u += pw*(r1*np.cos(h) + 1j*r2*np.sin(h))
+            psi_v += pw*(r2*np.sin(h) - 1j*r2*np.cos(h))
+        d = iwf.iwmodes[n].d_modes[m]
+        p =  1j*iwf.iwmodes[n].p_modes[m]
+        u =  1j*iwf.iwmodes[n].u_modes[m]
+        w = -1j*iwf.iwmodes[n].d_modes[m]*iwf.freqs[n]
+        for zn in range(len(iwf.depth)):
+            for xn in range(psi.shape[0]):
+                for yn in range(psi.shape[1]):
+                    field['d'][zn,xn,yn] += psi[xn,yn]*d[zn]
+                    field['u'][zn,xn,yn] += psi_u[xn,yn]*u[zn]
+                    field['v'][zn,xn,yn] += psi_v[xn,yn]*u[zn]
+                    field['p'][zn,xn,yn] += psi[xn,yn]*p[zn]
+                    field['w'][zn,xn,yn] += psi[xn,yn]*w[zn]
+    return field
+
+
+def test_field_component_matches_loop(make_field):
+    iwf = make_field(**GRID)
+    for n in range(iwf.nfreqs):
+        ref   = loop_field_component(iwf,n)
+        field = iwf.construct_field_component(n)
+        for var in VARIABLES:
+            assert field[var].shape == (11,7,7)
+            assert np.allclose(field[var],ref[var],rtol=1e-10,atol=1e-12*np.max(abs(ref[var]))), var
+
+
+def test_field_component_layout(make_field):
+    iwf   = make_field(**GRID)
+    field = iwf.construct_field_component(0)
+    for (x,y,z) in [(1,4,9),(6,0,3),(2,5,10)]:
+        xpos  = iwf.range[x] - iwf.offset[0]
+        ypos  = iwf.range[y] - iwf.offset[1]
+        d     = 0
+        for m in iwf.modes:
+            kmag = iwf.iwmodes[0].get_hwavenumber(m)
+            amps = iwf.get_amplitude(m,0)
+            psi  = sum(iwf.plane_wave(kmag,a,h,xpos,ypos) for a,h in zip(amps['amps'],amps['headings']))
+            d   += psi*iwf.iwmodes[0].d_modes[m][z]
+        assert np.isclose(field['d'][z,y,x],d,rtol=1e-10)
+
+
+def test_sensor_field_matches_grid(make_field):
+    coords = [(1,4,9),(6,0,3),(2,5,10),(0,0,0)]
+    grid   = make_field(**GRID)
+    sensor = make_field(**dict(GRID,coords=coords))
+    for n in range(grid.nfreqs):
+        gfield = grid.construct_field_component(n)
+        sfield = sensor.construct_field_component(n)
+        for var in VARIABLES:
+            ref = np.array([ gfield[var][z,y,x] for x,y,z in coords ])
+            assert np.allclose(sfield[var],ref,rtol=1e-10,atol=1e-12*np.max(abs(ref))), var
+
+
+def test_dispersion_table_must_match_field(make_field):
+    freqs = np.array([0.07,0.12])/3600
+    table = DispersionTable(np.linspace(0,5e3,11),freqs,num_eigs=2,validate=False)
+    iwf   = make_field(dispersion=table,**GRID)
+    assert len(iwf.iwmodes[0].d_modes[0]) == 11
+    with pytest.raises(ValueError):
+        make_field(dispersion=DispersionTable(np.linspace(0,5e3,15),freqs,num_eigs=2,validate=False),
+                   **GRID)
+    with pytest.raises(ValueError):
+        make_field(dispersion=DispersionTable(np.linspace(0,5e3,11),freqs,f=1e-5,num_eigs=2,
+                                              validate=False),**GRID)
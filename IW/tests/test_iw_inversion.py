@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from iw_inversion import InternalWaveInversion
+
+
+def make_inversion(make_field,modes=[0,1]):
+    rng     = np.random.default_rng(4)
+    amps    = [ {'amps' : 1e4*(rng.standard_normal(3) + 1j*rng.standard_normal(3)),
+                 'headings' : [0.3,1.2,2.0]} for w in range(2*(max(modes) + 1)) ]
+    coords  = [ (i,j,k) for i in (1,5,8) for j in (2,6) for k in (2,4,6,8) ]
+    iwf     = make_field(ndepth=10,modes=modes,amplitudes=amps,coords=coords,
+                         variables=['d','u','v'])
+    times   = np.arange(0,3600*300,1800.)
+    fields  = iwf.synthesize(iwf.time_steps(times))
+    inv     = InternalWaveInversion(iwf,variables=('d','u','v'),noise=1e-6,prior=1e12)
+    T,P     = len(times),len(coords)
+    inv.add_data(np.tile(iwf.xpts,T),np.tile(iwf.ypts,T),np.tile(iwf.zpts,T),np.repeat(times,P),
+                 { var : fields[var].real.reshape(-1) for var in ('d','u','v') })
+    return inv,iwf.wave_amplitudes(amps)
+
+
+def test_lsqr_converges_to_normal_solution(make_field):
+    inv,amps = make_inversion(make_field)
+    normal = inv.iwf.wave_amplitudes(inv.solve('normal'))
+    lsq    = inv.iwf.wave_amplitudes(inv.solve('lsqr'))
+    assert np.max(abs(normal - amps)) < 1e-4*np.max(abs(amps))
+    assert np.max(abs(lsq - normal)) < 1e-6*np.max(abs(amps))
+
+
+def test_lsqr_iteration_limit_raises(make_field):
+    inv,amps = make_inversion(make_field)
+    with pytest.raises(RuntimeError):
+        inv.solve('lsqr',iter_lim=5)
+
+
+def test_amplitude_table_indexed_by_mode_number(make_field):
+    inv,amps = make_inversion(make_field,modes=[1,2])
+    table    = inv.solve()
+    assert len(table) == 3*inv.iwf.nfreqs
+    assert np.allclose(inv.iwf.wave_amplitudes(table),inv.solution)
+    assert np.max(abs(inv.solution - amps)) < 1e-4*np.max(abs(amps))
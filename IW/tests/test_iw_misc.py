@@ -0,0 +1,74 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+import iw_misc as misc
+from iw_ensemble import InternalWaveEnsemble
+
+HEADINGS = np.array([0.3,1.7,4.0])
+
+
+def test_gm_rows_ordered_by_mode_number(freqs):
+    amps,theta = misc.gm_amplitude_arrays(freqs,[1,2],headings=3,realizations=4,seed=1)
+    assert amps.shape == (4,3*len(freqs),3)
+    assert theta.shape == amps.shape
+    assert np.all(amps[:,:len(freqs)] == 0)
+    assert np.all(amps[:,len(freqs):] != 0)
+
+    full,_ = misc.gm_amplitude_arrays(freqs,[0,1],headings=3,realizations=4,seed=1)
+    assert full.shape == (4,2*len(freqs),3)
+    with pytest.raises(ValueError):
+        misc.gm_amplitude_arrays(freqs,[-1,0])
+
+
+def test_gm_tables_drive_fields_with_missing_modes(make_field,freqs):
+    tables = misc.generate_gm_realizations(freqs,[1,2],headings=2,realizations=2,seed=3)
+    iwf    = make_field(modes=[1,2],storage='factored',amplitudes=tables[0])
+    waves  = iwf.wave_amplitudes()
+    assert len(waves) == 2*2*len(freqs)
+    assert np.all(waves != 0)
+
+
+def test_ensemble_arrays_with_missing_modes(tmp_path,make_field,freqs):
+    amps,theta = misc.gm_amplitude_arrays(freqs,[1,2],headings=HEADINGS,realizations=3,seed=5)
+    iwf   = make_field(modes=[1,2],storage='factored',
+                       amplitudes=misc.amplitude_table(amps[0],theta[0]))
+    ens   = InternalWaveEnsemble(np.arange(0,3600*4,3600.),iwf,amps,theta,dpath=str(tmp_path),fname='ens')
+    steps = iwf.time_steps(ens.timeaxis)
+    out   = ens.synthesize(steps)
+    for r in range(3):
+        iwf.set_amplitudes(misc.amplitude_table(amps[r],theta[r]))
+        ref = iwf.synthesize(steps)
+        for var in ens.variables:
+            assert np.allclose(out[var][r],ref[var],rtol=1e-10,atol=1e-12*np.max(abs(ref[var])))
+
+    with pytest.raises(ValueError):
+        InternalWaveEnsemble(ens.timeaxis,iwf,amps[:,len(freqs):],theta[:,len(freqs):],
+                             dpath=str(tmp_path),fname='ens')
+
+
+def test_ensemble_rejects_member_headings(tmp_path,make_field,freqs):
+    amps,theta = misc.gm_amplitude_arrays(freqs,[0,1],headings=2,realizations=3,seed=5)
+    iwf = make_field(modes=[0,1],storage='factored',
+                     amplitudes=misc.amplitude_table(amps[0],theta[0]))
+    with pytest.raises(ValueError):
+        InternalWaveEnsemble(np.arange(0,3600*4,3600.),iwf,amps,theta,dpath=str(tmp_path),fname='ens')
+    with pytest.raises(ValueError):
+        InternalWaveEnsemble(np.arange(0,3600*4,3600.),iwf,amps,dpath=str(tmp_path),fname='ens')
+
+
+def test_ensemble_parallel_matches_serial(tmp_path,make_field,freqs):
+    amps,theta = misc.gm_amplitude_arrays(freqs,[0,1],headings=HEADINGS,realizations=3,seed=5)
+    iwf    = make_field(modes=[0,1],storage='factored',
+                        amplitudes=misc.amplitude_table(amps[0],theta[0]))
+    frames = []
+    for workers in (1,2):
+        path = tmp_path/str(workers)
+        ens  = InternalWaveEnsemble(np.arange(0,3600*20,3600.),iwf,amps,theta,ftype=0,
+                                    dpath=str(path),fname='ens',blocksize=3)
+        ens.run(workers=workers)
+        frames.append({ f : pd.read_feather(os.path.join(str(path),f)) for f in os.listdir(str(path)) })
+    assert sorted(frames[0]) == sorted(frames[1])
+    for f in frames[0]:
+        assert frames[0][f].equals(frames[1][f]), f
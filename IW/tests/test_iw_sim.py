@@ -0,0 +1,94 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+import pytest
+
+from iw_sim import InternalWaveSimulation, FrameWriter
+
+
+def run_sim(path,workers,iwf,**kwargs):
+    timeaxis = np.arange(0,3600*300,3600.)
+    iws = InternalWaveSimulation(timeaxis,iwf,dpath=str(path),fname='run',
+                                 chunklim=7,**kwargs)
+    iws.run(workers=workers)
+    return { f : pd.read_feather(os.path.join(str(path),f)) for f in os.listdir(str(path)) }
+
+
+def test_phasor_parallel_matches_serial(tmp_path,make_field):
+    serial   = run_sim(tmp_path/'serial',1,make_field(),stepping='phasor',anchor=50,blocksize=9)
+    parallel = run_sim(tmp_path/'parallel',2,make_field(),stepping='phasor',anchor=50,blocksize=9)
+    assert sorted(serial) == sorted(parallel)
+    for f in serial:
+        assert serial[f].equals(parallel[f]), f
+
+
+def test_phasor_steps_depend_only_on_index(make_field):
+    timeaxis = np.arange(0,3600*300,3600.)
+    iws = InternalWaveSimulation(timeaxis,make_field(),dpath=os.getcwd(),
+                                 stepping='phasor',anchor=50)
+    whole  = iws.make_steps(timeaxis)
+    blocks = { i : iws.make_steps(timeaxis[i:i+7]) for i in range(0,300,7)[::-1] }
+    assert np.array_equal(whole,np.concatenate([ blocks[i] for i in sorted(blocks) ]))
+    assert iws.stepping_error() < 1e-12
+
+
+def test_stepping_error_is_double_precision(make_field):
+    timeaxis = np.arange(0,3600*300,3600.)
+    iws = InternalWaveSimulation(timeaxis,make_field(precision='single'),dpath=os.getcwd(),
+                                 stepping='phasor',anchor=50)
+    assert iws.stepping_error() < 1e-12
+
+
+def test_block_length_from_budget(tmp_path,make_field):
+    iwf  = make_field()
+    step = 3*len(iwf.variables)*16
+    iws  = InternalWaveSimulation(np.arange(100.),iwf,dpath=str(tmp_path),block_bytes=4*step + 1)
+    assert iws.block_length() == 4
+    assert [len(b) for b in iws.make_blocks(iws.timeaxis)][:2] == [4,4]
+    iws.block_bytes = 1
+    assert iws.block_length() == 1
+    iws.block_bytes = 2**30
+    assert iws.block_length() == 32
+    iws.blocksize = 5
+    assert iws.block_length() == 5
+
+
+def test_factored_parallel_matches_serial(tmp_path,make_field):
+    serial   = run_sim(tmp_path/'serial',1,make_field(storage='factored'))
+    parallel = run_sim(tmp_path/'parallel',2,make_field(storage='factored'))
+    assert sorted(serial) == sorted(parallel)
+    for f in serial:
+        assert serial[f].equals(parallel[f]), f
+
+
+def test_worker_copy_leaves_shared_arrays(tmp_path,make_field):
+    iwf = make_field(storage='factored')
+    iws = InternalWaveSimulation(np.arange(10.),iwf,dpath=str(tmp_path))
+    sim = iws.worker_copy()
+    assert sim.iwf.basis is None and iwf.basis is not None
+    sim.attach_shared(iws.shared_arrays())
+    steps = iwf.time_steps(iws.timeaxis)
+    for var,field in iwf.synthesize(steps).items():
+        assert np.array_equal(sim.iwf.synthesize(steps)[var],field)
+
+
+def test_variables_must_be_stored_on_field(tmp_path,make_field):
+    iwf = make_field(variables=['d','u'])
+    iws = InternalWaveSimulation(np.arange(10.),iwf,dpath=str(tmp_path),variables=['u'])
+    assert iws.variables == ['u']
+    with pytest.raises(ValueError):
+        InternalWaveSimulation(np.arange(10.),iwf,dpath=str(tmp_path),variables=['d','w'])
+
+
+def test_writer_time_is_wall_clock():
+    writer = FrameWriter(lambda frame,index : time.sleep(0.05),nthreads=4,maxsize=8)
+    start  = time.perf_counter()
+    for i in range(8):
+        writer.put(None,i)
+    writer.close()
+    wall  = time.perf_counter() - start
+    stats = writer.stats()
+    assert stats['write_time'] <= wall
+    assert stats['thread_time'] >= 0.4
+    assert stats['hidden_time'] <= wall